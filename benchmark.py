@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+#
+# Indentation finder, by Philippe Fremy <phil at freehackers dot org>
+# Copyright (C) 2013-2018 Steven Myint
+#
+# This program is distributed under the BSD license. You should have received
+# a copy of the file LICENSE.txt along with this software.
+
+"""Benchmark indent_finder over test_files and synthetic files.
+
+Each group of files is timed per stage: reading, analysing the lines and
+computing the results. The startup of the script on a single small file is
+timed too. The best of several repetitions is kept.
+
+With --save, timings are written to a JSON baseline. With --compare, the run
+fails if a group is more than --threshold percent slower than the baseline.
+
+With --sampling, large files that begin with a table indented with tabs are
+analysed from their first MAX_BYTES and from SAMPLE_WINDOWS windows instead,
+to compare the accuracy and cost of both.
+
+With --latency, test_files are read through indent_finder_async with that
+many seconds added to each read, as on a network file system, and with an
+increasing number of reads in flight.
+
+"""
+
+from __future__ import division
+
+import glob
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+# Import indent_finder from plugin/, where setup.py build_ext --inplace puts
+# its optional accelerator.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'plugin'))
+
+import indent_finder
+
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+SYNTHETIC_SIZES = [10000, 100000, 1000000, 10000000]
+
+SAMPLING_SIZES = [1000000, 10000000]
+SAMPLING_TABLE_SIZES = [0, 20000, 50000, 100000, 200000, 500000]
+
+CONCURRENCIES = [1, 4, 16, 64]
+
+DEFAULT_RESULT = (indent_finder.IndentType.space, 4)
+DEFAULT_TAB_WIDTH = 8
+
+
+def corpus_groups():
+    """Return list of (name, filenames) for test_files."""
+    groups = []
+    for directory in sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*'))):
+        filenames = sorted(glob.glob(os.path.join(directory, '*')))
+        if filenames:
+            groups.append(('test_files/' + os.path.basename(directory),
+                           filenames))
+    return groups
+
+
+def write_synthetic_file(filename, size, table_size=0):
+    """Write C-like code indented with four spaces of about size bytes.
+
+    The code comes after a table indented with tabs of about table_size bytes,
+    like generated code often has.
+
+    """
+    generator = random.Random(size)
+    output = open(filename, 'w')
+    try:
+        written = 0
+        if table_size:
+            output.write('int table[] = {\n')
+            while written < table_size:
+                line = '\t%d,\n' % generator.randint(0, 1000)
+                output.write(line)
+                written += len(line)
+            output.write('};\n')
+
+        depth = 0
+        while written < size:
+            if depth and generator.random() < 0.3:
+                depth -= 1
+                line = '    ' * depth + '}\n'
+            elif depth < 6 and generator.random() < 0.3:
+                line = '    ' * depth + 'if (x%d) {\n' % generator.randint(
+                    0, 1000)
+                depth += 1
+            else:
+                line = '    ' * depth + 'x = f(%d);\n' % generator.randint(
+                    0, 1000)
+            output.write(line)
+            written += len(line)
+    finally:
+        output.close()
+
+
+def synthetic_groups(directory):
+    """Return list of (name, filenames) for synthetic files in directory."""
+    groups = []
+    for size in SYNTHETIC_SIZES:
+        filename = os.path.join(directory, 'synthetic%d.c' % size)
+        write_synthetic_file(filename, size)
+        groups.append(('synthetic/%d' % size, [filename]))
+    return groups
+
+
+def time_group(filenames, repeat, windows=indent_finder.SAMPLE_WINDOWS):
+    """Return best timings of each stage in seconds and bytes read.
+
+    The number of files found to be indented with four spaces is returned
+    too.
+
+    """
+    finder = indent_finder.IndentFinder()
+    best = None
+    for _ in range(repeat):
+        read_time = 0.
+        analyse_time = 0.
+        results_time = 0.
+        size = 0
+        correct = 0
+        for filename in filenames:
+            start = timeit.default_timer()
+            lines = list(indent_finder.read_lines(filename,
+                                                  indent_finder.MAX_BYTES,
+                                                  windows=windows))
+            read_end = timeit.default_timer()
+
+            if lines and isinstance(lines[0], bytes):
+                analyse = finder.analyse_bytes_line
+            else:
+                analyse = finder.analyse_line
+            finder.clear()
+            for line in lines:
+                analyse(line)
+            analyse_end = timeit.default_timer()
+
+            result_data = indent_finder.results(
+                finder.lines,
+                default_tab_width=DEFAULT_TAB_WIDTH,
+                default_result=None)
+            results_end = timeit.default_timer()
+
+            if result_data == (indent_finder.IndentType.space, 4):
+                correct += 1
+
+            read_time += read_end - start
+            analyse_time += analyse_end - read_end
+            results_time += results_end - analyse_end
+            size += min(os.path.getsize(filename), indent_finder.MAX_BYTES)
+
+        total = read_time + analyse_time + results_time
+        if best is None or total < best['total']:
+            best = {'read': read_time,
+                    'analyse': analyse_time,
+                    'results': results_time,
+                    'total': total,
+                    'files': len(filenames),
+                    'bytes': size,
+                    'correct': correct}
+    return best
+
+
+def time_startup(filename, repeat):
+    """Return best wall time of a run of the script on filename.
+
+    The script is run like the vim plugin does, with -S -E. Import time, as
+    reported by -X importtime, is also returned.
+
+    """
+    command = [sys.executable, '-S', '-E', '-X', 'importtime',
+               os.path.join(ROOT_PATH, 'indent_finder.py'), filename]
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        (_, error) = process.communicate()
+        total = timeit.default_timer() - start
+
+        # Lines look like "import time: self | cumulative | name" where
+        # nested imports have an indented name.
+        imports = 0
+        for line in error.decode().splitlines():
+            fields = line.split('|')
+            if (
+                len(fields) == 3 and
+                fields[0].startswith('import time:') and
+                fields[1].strip().isdigit() and
+                not fields[2].startswith('  ')
+            ):
+                imports += int(fields[1]) / 1e6
+
+        if best is None or total < best['total']:
+            best = {'total': total, 'imports': imports}
+    return best
+
+
+def report(name, timings, baseline_timings):
+    total = timings['total']
+    line = '%-22s %8.0f files/s %8.2f MB/s  read %.4fs  ' \
+        'analyse %.4fs  results %.4fs' % (
+            name,
+            timings['files'] / total,
+            timings['bytes'] / total / 1e6,
+            timings['read'],
+            timings['analyse'],
+            timings['results'])
+    if baseline_timings:
+        line += '  %+.1f%%' % (
+            100 * (total - baseline_timings['total']) /
+            baseline_timings['total'])
+    return line
+
+
+def compare_sampling(directory, repeat):
+    """Print accuracy and timings of analysing the prefix or windows."""
+    for size in SAMPLING_SIZES:
+        filenames = []
+        for table_size in SAMPLING_TABLE_SIZES:
+            filename = os.path.join(directory,
+                                    'sampling%d-%d.c' % (size, table_size))
+            write_synthetic_file(filename, size, table_size=table_size)
+            filenames.append(filename)
+
+        for (name, windows) in [('prefix', 1),
+                                ('sampled', indent_finder.SAMPLE_WINDOWS)]:
+            timings = time_group(filenames, repeat=repeat, windows=windows)
+            print('%-22s %d/%d correct  read %.4fs  analyse %.4fs' % (
+                'sampling/%d/%s' % (size, name),
+                timings['correct'],
+                timings['files'],
+                timings['read'],
+                timings['analyse']))
+            sys.stdout.flush()
+
+
+def compare_concurrency(latency, repeat):
+    """Print the throughput of indent_finder_async on a slow file system."""
+    import time
+
+    import indent_finder_async
+
+    def slow_read(filename):
+        time.sleep(latency)
+        return indent_finder_async.read_file(filename)
+
+    filenames = [filename
+                 for (_, group) in corpus_groups()
+                 for filename in group]
+    for concurrency in CONCURRENCIES:
+        best = None
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            for _ in indent_finder_async.iterate_results(
+                    filenames,
+                    default_tab_width=DEFAULT_TAB_WIDTH,
+                    default_result=DEFAULT_RESULT,
+                    concurrency=concurrency,
+                    read=slow_read):
+                pass
+            total = timeit.default_timer() - start
+            if best is None or total < best:
+                best = total
+
+        print('%-22s %8.0f files/s' % ('concurrency/%d' % (concurrency,),
+                                        len(filenames) / best))
+        sys.stdout.flush()
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--repeat', type=int, default=5,
+                      help='number of runs of each group, the best is kept '
+                           '(%default)')
+    parser.add_option('--save', metavar='FILE',
+                      help='write timings to FILE as a JSON baseline')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare timings with a baseline saved by --save')
+    parser.add_option('--threshold', type=float, default=10.,
+                      help='with --compare, fail if a group is more than '
+                           'this many percent slower (%default)')
+    parser.add_option('--latency', type=float, metavar='SECONDS',
+                      help='compare concurrent reads with this latency '
+                           'added to each read')
+    parser.add_option('--sampling', action='store_true',
+                      help='compare the accuracy of analysing the beginning '
+                           'of large files with sampling them')
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error('unexpected arguments')
+
+    if options.latency is not None:
+        compare_concurrency(options.latency, repeat=options.repeat)
+        return
+
+    if options.sampling:
+        directory = tempfile.mkdtemp()
+        try:
+            compare_sampling(directory, repeat=options.repeat)
+        finally:
+            shutil.rmtree(directory)
+        return
+
+    baseline = {}
+    if options.compare:
+        input_file = open(options.compare)
+        try:
+            baseline = json.load(input_file)
+        finally:
+            input_file.close()
+
+    directory = tempfile.mkdtemp()
+    try:
+        groups = corpus_groups() + synthetic_groups(directory)
+
+        timings = {}
+        overall = {}
+        for (name, filenames) in groups:
+            timings[name] = time_group(filenames, repeat=options.repeat)
+            for (key, value) in timings[name].items():
+                overall[key] = overall.get(key, 0) + value
+            print(report(name, timings[name], baseline.get(name)))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+
+    timings['all'] = overall
+    print(report('all', overall, baseline.get('all')))
+
+    timings['startup'] = time_startup(
+        os.path.join(ROOT_PATH, 'test_files', 'space1', 'one.cc'),
+        repeat=options.repeat)
+    line = '%-22s %8.1f ms wall  imports %.1f ms' % (
+        'startup',
+        timings['startup']['total'] * 1e3,
+        timings['startup']['imports'] * 1e3)
+    if 'startup' in baseline:
+        line += '  %+.1f%%' % (
+            100 * (timings['startup']['total'] -
+                   baseline['startup']['total']) /
+            baseline['startup']['total'])
+    print(line)
+
+    regressions = []
+    for name in sorted(timings):
+        if (
+            name in baseline and
+            timings[name]['total'] > baseline[name]['total'] *
+            (1 + options.threshold / 100)
+        ):
+            regressions.append(name)
+
+    if options.save:
+        output_file = open(options.save, 'w')
+        try:
+            json.dump(timings, output_file, indent=2, sort_keys=True)
+        finally:
+            output_file.close()
+
+    if regressions:
+        sys.stderr.write('slower than baseline by more than %g%%: %s\n' %
+                         (options.threshold, ', '.join(regressions)))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
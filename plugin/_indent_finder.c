@@ -0,0 +1,266 @@
+/*
+ * Indentation finder, by Philippe Fremy <phil at freehackers dot org>
+ * Copyright (C) 2013-2018 Steven Myint
+ *
+ * This program is distributed under the BSD license. You should have received
+ * a copy of the file LICENSE.txt along with this software.
+ *
+ * Optional accelerator of indent_finder.py. It provides classify_line() and
+ * classify_bytes_line(), which behave exactly like those of indent_finder.py,
+ * and is used instead of them if it was built. See setup.py.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+/* Must match MAX_SPACES and LineCode of indent_finder.py. */
+#define MAX_SPACES 8
+
+#define NO_INDENT 0
+#define SPACE_ONLY 1
+#define TAB_ONLY 2
+#define MIXED 3
+#define BEGIN_SPACE 4
+
+/* Like _MAX_SHARED_WIDTH of indent_finder.py. */
+#define MAX_SHARED_WIDTH 64
+
+/* Line infos are shared, like in indent_finder.py, and created on first
+ * use. */
+static PyObject *no_indent_info;
+static PyObject *begin_space_infos[MAX_SPACES];
+static PyObject *space_only_infos[MAX_SHARED_WIDTH];
+static PyObject *tab_only_infos[MAX_SHARED_WIDTH];
+static PyObject *mixed_infos[MAX_SHARED_WIDTH][MAX_SPACES];
+
+/* Return a new reference to the line info (code, tabs, spaces). */
+static PyObject *
+line_info(int code, Py_ssize_t tabs, Py_ssize_t spaces)
+{
+    PyObject **slot = NULL;
+    PyObject *info;
+
+    switch (code) {
+    case NO_INDENT:
+        slot = &no_indent_info;
+        break;
+    case BEGIN_SPACE:
+        slot = &begin_space_infos[spaces];
+        break;
+    case SPACE_ONLY:
+        if (spaces < MAX_SHARED_WIDTH) {
+            slot = &space_only_infos[spaces];
+        }
+        break;
+    case TAB_ONLY:
+        if (tabs < MAX_SHARED_WIDTH) {
+            slot = &tab_only_infos[tabs];
+        }
+        break;
+    case MIXED:
+        if (tabs < MAX_SHARED_WIDTH) {
+            slot = &mixed_infos[tabs][spaces];
+        }
+        break;
+    }
+
+    if (slot != NULL && *slot != NULL) {
+        Py_INCREF(*slot);
+        return *slot;
+    }
+
+    info = Py_BuildValue("(inn)", code, tabs, spaces);
+    if (info != NULL && slot != NULL) {
+        Py_INCREF(info);
+        *slot = info;
+    }
+    return info;
+}
+
+/* Read character i of data, made of kind bytes wide characters. */
+#define READ(kind, data, i) \
+    ((kind) == 1 ? (Py_UCS4)((const unsigned char *)(data))[i] : \
+     (kind) == 2 ? (Py_UCS4)((const unsigned short *)(data))[i] : \
+     ((const Py_UCS4 *)(data))[i])
+
+/* Classify a line like classify_line() of indent_finder.py. If newline is
+ * true, the line may end with '\n'. */
+static PyObject *
+classify(const void *data, int kind, Py_ssize_t length, int newline)
+{
+    Py_ssize_t width;
+    Py_ssize_t tabs = 0;
+    Py_ssize_t spaces;
+    Py_ssize_t i;
+    Py_UCS4 character;
+
+    if (length == 0 ||
+        (newline && length == 1 && READ(kind, data, 0) == '\n')) {
+        Py_RETURN_NONE;
+    }
+
+    character = READ(kind, data, 0);
+    if (character != ' ' && character != '\t') {
+        return line_info(NO_INDENT, 0, 0);
+    }
+
+    for (width = 0; width < length; width++) {
+        character = READ(kind, data, width);
+        if (character == '\t') {
+            tabs++;
+        }
+        else if (character != ' ') {
+            break;
+        }
+    }
+
+    if (width == length ||
+        (newline && width == length - 1 && character == '\n')) {
+        Py_RETURN_NONE;
+    }
+
+    if (character == '*' || character == '#') {
+        /* Python, C/C++ comment or continuation of a C/C++ comment, might
+         * not be indented correctly. */
+        Py_RETURN_NONE;
+    }
+
+    if (character == '/' && width + 1 < length &&
+        READ(kind, data, width + 1) == '*') {
+        Py_RETURN_NONE;
+    }
+
+    if (tabs == 0) {
+        if (width < MAX_SPACES) {
+            /* This could be mixed mode too. */
+            return line_info(BEGIN_SPACE, 0, width);
+        }
+        /* This is really a line indented with spaces. */
+        return line_info(SPACE_ONLY, 0, width);
+    }
+
+    if (tabs == width) {
+        return line_info(TAB_ONLY, tabs, 0);
+    }
+
+    /* Mixed mode. */
+    for (i = 0; i < tabs; i++) {
+        if (READ(kind, data, i) != '\t') {
+            /* Line is not composed of '\t\t\t    ', ignore it. */
+            Py_RETURN_NONE;
+        }
+    }
+
+    spaces = width - tabs;
+    if (spaces >= MAX_SPACES) {
+        /* This is not mixed mode, this is garbage! */
+        Py_RETURN_NONE;
+    }
+
+    return line_info(MIXED, tabs, spaces);
+}
+
+static PyObject *
+classify_bytes_line(PyObject *self, PyObject *line)
+{
+    if (!PyBytes_Check(line)) {
+        PyErr_SetString(PyExc_TypeError, "line must be bytes");
+        return NULL;
+    }
+
+    return classify(PyBytes_AS_STRING(line), 1, PyBytes_GET_SIZE(line), 1);
+}
+
+#if PY_MAJOR_VERSION >= 3
+static PyObject *
+classify_line(PyObject *self, PyObject *line)
+{
+    if (!PyUnicode_Check(line)) {
+        PyErr_SetString(PyExc_TypeError, "line must be str");
+        return NULL;
+    }
+
+#if PY_VERSION_HEX < 0x030C0000
+    if (PyUnicode_READY(line) < 0) {
+        return NULL;
+    }
+#endif
+
+    return classify(PyUnicode_DATA(line), PyUnicode_KIND(line),
+                    PyUnicode_GET_LENGTH(line), 0);
+}
+#endif
+
+static PyMethodDef methods[] = {
+    {"classify_bytes_line", classify_bytes_line, METH_O,
+     "Like classify_bytes_line() of indent_finder."},
+#if PY_MAJOR_VERSION >= 3
+    /* Python 2 keeps classify_line() of indent_finder for unicode lines. */
+    {"classify_line", classify_line, METH_O,
+     "Like classify_line() of indent_finder."},
+#endif
+    {NULL, NULL, 0, NULL}
+};
+
+/* Exported so that indent_finder.py can check that they match its own. */
+static const struct {
+    const char *name;
+    long value;
+} constants[] = {
+    {"MAX_SPACES", MAX_SPACES},
+    {"MAX_SHARED_WIDTH", MAX_SHARED_WIDTH},
+    {"NO_INDENT", NO_INDENT},
+    {"SPACE_ONLY", SPACE_ONLY},
+    {"TAB_ONLY", TAB_ONLY},
+    {"MIXED", MIXED},
+    {"BEGIN_SPACE", BEGIN_SPACE},
+};
+
+static int
+add_constants(PyObject *module)
+{
+    size_t i;
+    for (i = 0; i < sizeof(constants) / sizeof(constants[0]); ++i) {
+        if (PyModule_AddIntConstant(module, constants[i].name,
+                                    constants[i].value) < 0) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+#if PY_MAJOR_VERSION >= 3
+static struct PyModuleDef module_definition = {
+    PyModuleDef_HEAD_INIT,
+    "_indent_finder",
+    "Optional accelerator of indent_finder.",
+    -1,
+    methods
+};
+
+PyMODINIT_FUNC
+PyInit__indent_finder(void)
+{
+    PyObject *module = PyModule_Create(&module_definition);
+    if (module == NULL) {
+        return NULL;
+    }
+
+    if (add_constants(module) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+
+    return module;
+}
+#else
+PyMODINIT_FUNC
+init_indent_finder(void)
+{
+    PyObject *module = Py_InitModule3(
+        "_indent_finder", methods, "Optional accelerator of indent_finder.");
+    if (module != NULL) {
+        add_constants(module);
+    }
+}
+#endif
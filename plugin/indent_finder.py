@@ -24,19 +24,46 @@ for example. In my opinion, this is the worst possible style.
 
 from __future__ import division
 
-import optparse
-import re
+import itertools
+import os
 import sys
 
 
 __version__ = '2.0a0'
 
 
-INDENT_RE = re.compile('^([ \t]+)([^ \t]+)')
-MIXED_RE = re.compile('^(\t+)( +)$')
+# INDENT_RE and MIXED_RE are compiled on first access, see __getattr__(), so
+# that running the script does not import re.
+_LAZY_PATTERNS = {
+    'INDENT_RE': '^([ \t]+)([^ \t]+)',
+    'MIXED_RE': '^(\t+)( +)$',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_PATTERNS:
+        raise AttributeError('module %r has no attribute %r' %
+                             (__name__, name))
+
+    import re
+    pattern = re.compile(_LAZY_PATTERNS[name])
+    globals()[name] = pattern
+    return pattern
+
+
+if sys.version_info < (3, 7):
+    # Older versions ignore the __getattr__() of modules.
+    INDENT_RE = __getattr__('INDENT_RE')
+    MIXED_RE = __getattr__('MIXED_RE')
+
 
 MAX_BYTES = 100000
 
+# Files larger than MAX_BYTES are sampled with that many windows spread across
+# them, rather than only analysed from the beginning, which is often a license
+# header or generated tables. See read_bytes().
+SAMPLE_WINDOWS = 4
+
 MIN_SPACES = 1
 MAX_SPACES = 8
 
@@ -66,45 +93,354 @@ class IndentType(object):
 
 def parse_file(filename,
                default_tab_width,
-               default_result):
+               default_result,
+               early_exit=False,
+               input_file=None):
     """Return result of indentation analysis.
 
     Interpret with results_to_string() or vim_output().
 
+    With early_exit, the analysis stops as soon as the rest of the file cannot
+    change the result.
+
+    Files larger than MAX_BYTES are sampled with SAMPLE_WINDOWS windows.
+
+    If input_file is given, the content is read from this binary file object
+    instead, like standard input or an editor buffer. Only its first MAX_BYTES
+    are analysed. filename then only decides which rules apply, like those of
+    LANGUAGE_PRE_INDENTATION.
+
     """
     return _parse_file(IndentFinder(),
                        filename=filename,
                        default_tab_width=default_tab_width,
-                       default_result=default_result)
+                       default_result=default_result,
+                       early_exit=early_exit,
+                       input_file=input_file)
+
+
+def _parse_file(finder, filename, default_tab_width, default_result,
+                early_exit=False, input_file=None, measure=False):
+    finder.lines_saved = 0
+    finder.evidence = None
+    finder.lines_examined = finder.bytes_examined = 0
+
+    result_data = _preset_result(filename,
+                                 default_tab_width=default_tab_width,
+                                 default_result=default_result)
+    if result_data is not None:
+        return result_data
+
+    if finder.counters is not None:
+        return _parse_file_in_stages(finder, filename,
+                                     default_tab_width=default_tab_width,
+                                     default_result=default_result,
+                                     early_exit=early_exit,
+                                     input_file=input_file,
+                                     measure=measure)
+
+    if input_file is not None:
+        data = input_file.read(MAX_BYTES)
+        lines = split_byte_lines(data)
+        budget = len(data)
+    else:
+        if finder.read_buffer is None:
+            finder.read_buffer = bytearray(MAX_BYTES)
+        lines = read_lines(filename, MAX_BYTES,
+                           windows=SAMPLE_WINDOWS,
+                           buffer=finder.read_buffer)
+        if early_exit:
+            file_size = os.path.getsize(filename)
+            if file_size > MAX_BYTES:
+                # The sampled windows are joined with gaps.
+                budget = MAX_BYTES + len(_WINDOW_GAP) * (SAMPLE_WINDOWS - 1)
+            else:
+                budget = file_size or MAX_BYTES
+        else:
+            budget = MAX_BYTES
+
+    return _parse_lines(finder, filename, lines,
+                        default_tab_width=default_tab_width,
+                        default_result=default_result,
+                        early_exit=early_exit,
+                        budget=budget,
+                        measure=measure)
+
+
+def parse_lines(lines,
+                default_tab_width,
+                default_result,
+                filename='',
+                max_bytes=MAX_BYTES,
+                max_lines=None):
+    """Return result of indentation analysis of lines, like parse_file().
+
+    lines may be any iterable of str or bytes lines, like a file object, a
+    generator or a list. It is consumed lazily and only until max_bytes bytes,
+    or characters for str lines, or max_lines lines were analysed. Either
+    budget may be None to analyse everything. Lines may end with their line
+    break. filename only decides which rules apply, like those of
+    LANGUAGE_PRE_INDENTATION.
+
+    """
+    result_data = _preset_result(filename,
+                                 default_tab_width=default_tab_width,
+                                 default_result=default_result)
+    if result_data is not None:
+        return result_data
+
+    return _parse_lines(IndentFinder(), filename,
+                        _stream_lines(lines,
+                                      max_bytes=max_bytes,
+                                      max_lines=max_lines),
+                        default_tab_width=default_tab_width,
+                        default_result=default_result)
+
+
+def _stream_lines(lines, max_bytes, max_lines):
+    """Yield lines without line breaks, up to max_bytes and max_lines."""
+    if max_bytes is not None and max_bytes <= 0:
+        return
+
+    for line in itertools.islice(lines, max_lines):
+        if max_bytes is not None:
+            # Like reading the first max_bytes of a file, the last line may
+            # be cut.
+            line = line[:max_bytes]
+            max_bytes -= len(line)
+
+        # Only split where str.splitlines() would, like parse_file() does,
+        # but keep empty lines, which separate the lines around them.
+        if (
+            isinstance(line, bytes) and
+            _contains_any(line, UNICODE_LINE_BOUNDARIES)
+        ):
+            # Stay with bytes, which the lines before were analysed as.
+            parts = [part.encode('utf-8') for part in decode_lines(line)]
+        else:
+            parts = line.splitlines()
+
+        for part in parts or [line]:
+            yield part
 
+        if max_bytes is not None and max_bytes <= 0:
+            # Do not consume a line that would not be analysed.
+            break
 
-def _parse_file(finder, filename, default_tab_width, default_result):
-    if filename.lower() == 'makefile' or filename.endswith('.mk'):
+
+def _preset_result(filename, default_tab_width, default_result):
+    """Return result decided by the filename alone or None.
+
+    Such files do not need to be read at all.
+
+    """
+    if (
+        os.path.basename(filename).lower() == 'makefile' or
+        filename.endswith('.mk')
+    ):
         return (IndentType.tab, default_tab_width)
 
     for extension in BLACKLISTED_EXTENSIONS:
         if filename.endswith(extension):
             return default_result
 
-    required_ending = None
-    for extension, ending in LANGUAGE_PRE_INDENTATION.items():
-        if filename.endswith(extension):
-            required_ending = ending
+    return None
+
+
+# Number of lines between two checks of whether the analysis can stop early.
+EARLY_EXIT_INTERVAL = 64
+
+
+def _parse_lines(finder, filename, lines, default_tab_width, default_result,
+                 early_exit=False, budget=MAX_BYTES, measure=False):
+    """Return result of the analysis of lines.
+
+    lines may hold str or undecoded bytes, as returned by read_lines().
+
+    With early_exit, stop once the result cannot change within the rest of
+    the budget, in bytes, and set finder.lines_saved to the number of lines
+    that were not analysed.
+
+    finder.evidence is set to the counts the result was decided from, which
+    are all zero if the required ending of the language was not found. It is
+    finder.counts itself, so it must be copied to outlive the next analysis.
+
+    With measure, finder.lines_examined and finder.bytes_examined are set to
+    the number of lines analysed and their length without line breaks.
+
+    """
+    if not _analyse_lines(finder, filename, lines,
+                          early_exit=early_exit,
+                          budget=budget,
+                          measure=measure):
+        return default_result
+
+    return _results_from_counts(finder.counts,
+                                default_tab_width=default_tab_width,
+                                default_result=default_result)
+
+
+def _analyse_lines(finder, filename, lines, early_exit, budget, measure):
+    """Count the indentation steps of lines like _parse_lines().
+
+    Return False if the result is the default since the required ending of
+    the language was not found.
+
+    """
+    required_ending = _required_ending(filename)
 
     finder.clear()
+
+    lines = iter(lines)
+    for first_line in lines:
+        lines = itertools.chain([first_line], lines)
+        break
+    else:
+        first_line = None
+
+    if isinstance(first_line, bytes):
+        analyse = finder.analyse_bytes_line
+        ends_with = _bytes_line_ends_with
+    else:
+        analyse = finder.analyse_line
+        ends_with = _line_ends_with
+
+    if measure:
+        analyse = _measuring(finder, analyse)
+
     found_required_ending = False
-    for line in forcefully_read_lines(filename, MAX_BYTES):
-        finder.analyse_line(line)
+    consumed = 0
+    countdown = EARLY_EXIT_INTERVAL
+    for line in lines:
+        analyse(line)
 
-        if required_ending and line.rstrip().endswith(required_ending):
+        if (
+            required_ending and
+            not found_required_ending and
+            ends_with(line, required_ending)
+        ):
             found_required_ending = True
 
+        if early_exit:
+            # Split lines lost their line break, which took at least a byte,
+            # but other lines may keep it. Decoded characters may have taken
+            # more than one byte, so the remaining budget may only be
+            # overestimated.
+            consumed += len(line) + (line[-1:] not in _LINE_BREAKS)
+            countdown -= 1
+            if (
+                not countdown and
+                (found_required_ending or not required_ending)
+            ):
+                countdown = EARLY_EXIT_INTERVAL
+                if is_settled(finder.counts,
+                              max_increment=max_increment(budget -
+                                                          consumed)):
+                    finder.lines_saved = sum(1 for _ in lines)
+                    break
+
     if required_ending and not found_required_ending:
-        return default_result
+        finder.evidence = _ZERO_COUNTS
+        return False
+
+    finder.evidence = finder.counts
+    return True
+
+
+def _parse_file_in_stages(finder, filename, default_tab_width,
+                          default_result, early_exit, input_file, measure):
+    """Return result like _parse_file() while timing each stage.
+
+    The time spent reading, splitting and decoding lines, analysing them and
+    computing the result is added to the counters of the ProfilingIndentFinder
+    finder. The first MAX_BYTES are read at once, rather than lazily, to tell
+    reading and analysing apart.
+
+    """
+    import timeit
+
+    timer = timeit.default_timer
+    counters = finder.counters
+
+    start = timer()
+    if input_file is not None:
+        data = input_file.read(MAX_BYTES)
+    else:
+        data = read_bytes(filename, MAX_BYTES, windows=SAMPLE_WINDOWS)
+    read_end = timer()
+
+    lines = split_byte_lines(data)
+    split_end = timer()
+
+    counters['bytes read'] += len(data)
+    if lines and not isinstance(lines[0], bytes):
+        counters['bytes decoded'] += len(data)
+
+    if _analyse_lines(finder, filename, lines,
+                      early_exit=early_exit,
+                      budget=len(data),
+                      measure=measure):
+        analyse_end = timer()
+        result_data = _results_from_counts(
+            finder.counts,
+            default_tab_width=default_tab_width,
+            default_result=default_result)
+    else:
+        analyse_end = timer()
+        result_data = default_result
+    end = timer()
+
+    counters['read seconds'] += read_end - start
+    counters['split seconds'] += split_end - read_end
+    counters['analyse seconds'] += analyse_end - split_end
+    counters['results seconds'] += end - analyse_end
+
+    return result_data
+
+
+_LINE_BREAKS = (b'\n', '\n')
+
+
+def _measuring(finder, analyse):
+    """Return analyse() adding to finder.lines_examined and bytes_examined."""
+    finder.lines_examined = finder.bytes_examined = 0
+
+    def measured_analyse(line):
+        finder.lines_examined += 1
+        finder.bytes_examined += len(line) - (line[-1:] in _LINE_BREAKS)
+        return analyse(line)
+
+    return measured_analyse
+
+
+def _required_ending(filename):
+    """Return the ending a line must have for filename to be analysed."""
+    required_ending = None
+    for extension, ending in LANGUAGE_PRE_INDENTATION.items():
+        if filename.endswith(extension):
+            required_ending = ending
+    return required_ending
+
 
-    return results(finder.lines,
-                   default_tab_width=default_tab_width,
-                   default_result=default_result)
+def _line_ends_with(line, ending):
+    return line.rstrip().endswith(ending)
+
+
+# Bytes that str.rstrip() removes from the end of an ASCII line.
+ASCII_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+
+def _bytes_line_ends_with(line, ending):
+    """Return _line_ends_with() of the decoded line, only decoding if needed.
+
+    ending must be ASCII.
+
+    """
+    stripped = line.rstrip(ASCII_WHITESPACE)
+    if stripped[-1:] >= b'\x80':
+        # There may be some Unicode whitespace to strip.
+        return _line_ends_with(line.decode('utf-8', 'replace'), ending)
+    return stripped.endswith(ending.encode('ascii'))
 
 
 class LineType(object):
@@ -116,6 +452,43 @@ class LineType(object):
     begin_space = 'begin_space'
 
 
+class LineCode(object):
+
+    """Integer counterparts of LineType, as returned by classify_line()."""
+
+    no_indent = 0
+    space_only = 1
+    tab_only = 2
+    mixed = 3
+    begin_space = 4
+
+
+LINE_TYPES = {
+    LineCode.no_indent: LineType.no_indent,
+    LineCode.space_only: LineType.space_only,
+    LineCode.tab_only: LineType.tab_only,
+    LineCode.mixed: LineType.mixed,
+    LineCode.begin_space: LineType.begin_space,
+}
+
+# Keys of IndentFinder.lines, in the order of IndentFinder.counts.
+COUNT_KEYS = (
+    ['tab'] +
+    ['space%d' % i for i in range(MIN_SPACES, MAX_SPACES + 1)] +
+    ['mixed%d' % i for i in range(MIN_SPACES, MAX_SPACES + 1)])
+
+TAB_INDEX = 0
+
+_ZERO_COUNTS = (0,) * len(COUNT_KEYS)
+
+# Index of 'space%d' % n is SPACE_OFFSET + n and similarly for mixed.
+SPACE_OFFSET = 1 - MIN_SPACES
+MIXED_OFFSET = SPACE_OFFSET + MAX_SPACES - MIN_SPACES + 1
+
+
+_BYTES_CONTINUATIONS = (b'\\', b'\\\n')
+
+
 class IndentFinder(object):
 
     r"""IndentFinder reports the indentation used in a source file.
@@ -169,20 +542,36 @@ class IndentFinder(object):
 
     """
 
+    # Only a ProfilingIndentFinder counts what it does.
+    counters = None
+
+    # The state of a finder is reused from one file to the next, so that
+    # analysing many files does not allocate much.
+    __slots__ = ('skip_next_line', 'previous_line_info', 'counts',
+                 'lines_saved', 'evidence', 'lines_examined',
+                 'bytes_examined', 'read_buffer')
+
     def __init__(self):
         self.skip_next_line = False
         self.previous_line_info = None
-        self.lines = {}
+        self.counts = [0] * len(COUNT_KEYS)
+        self.lines_saved = 0
+        self.evidence = None
+        self.lines_examined = 0
+        self.bytes_examined = 0
+        self.read_buffer = None
 
         self.clear()
 
+    @property
+    def lines(self):
+        """Return counts keyed by 'tab', 'space%d' and 'mixed%d'."""
+        return dict(zip(COUNT_KEYS, self.counts))
+
     def clear(self):
-        self.lines = {}
-        for i in range(MIN_SPACES, MAX_SPACES + 1):
-            self.lines['space%d' % i] = 0
-        for i in range(MIN_SPACES, MAX_SPACES + 1):
-            self.lines['mixed%d' % i] = 0
-        self.lines['tab'] = 0
+        self.counts[:] = _ZERO_COUNTS
+        self.lines_saved = 0
+        self.evidence = None
 
         self.skip_next_line = False
         self.previous_line_info = None
@@ -199,79 +588,381 @@ class IndentFinder(object):
         if skip_current_line:
             return
 
-        ret = self.analyse_line_indentation(line)
-        return ret
+        return self.analyse_line_info(classify_line(line))
+
+    def analyse_bytes_line(self, line):
+        """Like analyse_line() but for an undecoded line."""
+        skip_current_line = self.skip_next_line
+        self.skip_next_line = line.endswith(_BYTES_CONTINUATIONS)
+
+        if skip_current_line:
+            return
+
+        return self.analyse_line_info(classify_bytes_line(line))
 
     def analyse_line_indentation(self, line):
+        return self.analyse_line_info(classify_line(line))
+
+    def analyse_line_info(self, current_line_info):
+        """Count the step from the previous line, as given by classify_line().
+
+        Return the key of the count that was updated, or None.
+
+        """
         previous_line_info = self.previous_line_info
-        current_line_info = analyse_line_type(line)
         self.previous_line_info = current_line_info
 
         if current_line_info is None or previous_line_info is None:
             return
 
-        t = (previous_line_info[0], current_line_info[0])
+        index = count_indentation_step(self.counts,
+                                       previous_line_info,
+                                       current_line_info)
+        if index is None:
+            return None
+        return COUNT_KEYS[index]
+
+
+PROFILE_COUNTERS = (
+    ['%s lines' % LINE_TYPES[code] for code in sorted(LINE_TYPES)] +
+    ['blank lines', 'comment lines', 'malformed lines',
+     'continuation lines skipped',
+     'bytes read', 'bytes decoded',
+     'read seconds', 'split seconds', 'analyse seconds', 'results seconds'])
+
+
+class ProfilingIndentFinder(IndentFinder):
+
+    """IndentFinder that counts what it does, to tell where time goes.
+
+    counters maps each name of PROFILE_COUNTERS to its value, accumulated
+    over all the analysed lines and files until reset_counters():
+    - '<LineType> lines': lines classified as each LineType
+    - 'blank lines', 'comment lines' and 'malformed lines': lines rejected by
+      classify_line(), like a mixture of tabs and spaces for malformed ones
+    - 'continuation lines skipped': lines after a line ending in '\\'
+    - 'bytes read' and 'bytes decoded': bytes read from files and those that
+      had to be decoded since they hold Unicode line boundaries
+    - '<stage> seconds': time spent in each stage of parse_file(), which is
+      only timed for a ProfilingIndentFinder
+
+    IndentFinder itself does none of this, so that it costs nothing unless
+    this class is used instead.
+
+    """
+
+    __slots__ = ('counters', '_line')
+
+    def __init__(self):
+        self.counters = {}
+        self.reset_counters()
+        self._line = None
+
+        IndentFinder.__init__(self)
+
+    def reset_counters(self):
+        for name in PROFILE_COUNTERS:
+            self.counters[name] = 0
+
+    def analyse_line(self, line):
+        if self.skip_next_line:
+            self.counters['continuation lines skipped'] += 1
+        self._line = line
+        return IndentFinder.analyse_line(self, line)
+
+    def analyse_bytes_line(self, line):
+        if self.skip_next_line:
+            self.counters['continuation lines skipped'] += 1
+        self._line = line
+        return IndentFinder.analyse_bytes_line(self, line)
+
+    def analyse_line_indentation(self, line):
+        self._line = line
+        return IndentFinder.analyse_line_indentation(self, line)
+
+    def analyse_line_info(self, current_line_info):
+        if current_line_info is None:
+            self.counters[_rejection_counter(self._line)] += 1
+        else:
+            self.counters['%s lines' % LINE_TYPES[current_line_info[0]]] += 1
+        return IndentFinder.analyse_line_info(self, current_line_info)
+
+
+def _rejection_counter(line):
+    """Return counter of a line rejected by classify_line()."""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
+
+    text = line.strip()
+    if not text:
+        return 'blank lines'
+    if text.startswith(('*', '#', '/*')):
+        return 'comment lines'
+    return 'malformed lines'
+
+
+def count_indentation_step(counts, previous_line_info, current_line_info,
+                           delta=1):
+    """Add delta to the counts of the step between two significant lines.
+
+    Both line infos are as returned by classify_line(). Return the index of
+    the reported count, or None if the step is not significant. A step that
+    could be either space or mixed indentation is counted as both and reported
+    as space.
+
+    """
+    (previous_code, previous_tabs, previous_spaces) = previous_line_info
+    (code, tabs, spaces) = current_line_info
+
+    if code == LineCode.tab_only:
         if (
-            t == (LineType.tab_only, LineType.tab_only) or
-            t == (LineType.no_indent, LineType.tab_only)
+            previous_code == LineCode.tab_only or
+            previous_code == LineCode.no_indent
         ):
-            if len(current_line_info[1]) - len(previous_line_info[1]) == 1:
-                self.lines['tab'] += 1
-                return IndentType.tab
-
-        elif (t == (LineType.space_only, LineType.space_only) or
-              t == (LineType.begin_space, LineType.space_only) or
-              t == (LineType.no_indent, LineType.space_only)):
-            nb_space = len(current_line_info[1]) - len(previous_line_info[1])
-            if MIN_SPACES <= nb_space <= MAX_SPACES:
-                key = 'space%d' % nb_space
-                self.lines[key] += 1
-                return key
+            if tabs - previous_tabs == 1:
+                counts[TAB_INDEX] += delta
+                return TAB_INDEX
 
-        elif (t == (LineType.begin_space, LineType.begin_space) or
-              t == (LineType.no_indent, LineType.begin_space)):
-            nb_space = len(current_line_info[1]) - len(previous_line_info[1])
-            if MIN_SPACES <= nb_space <= MAX_SPACES:
-                key1 = 'space%d' % nb_space
-                key2 = 'mixed%d' % nb_space
-                self.lines[key1] += 1
-                self.lines[key2] += 1
-                return key1
-
-        elif t == (LineType.begin_space, LineType.tab_only):
+        elif previous_code == LineCode.begin_space:
             # We assume that mixed indentation used MAX_SPACES characters tabs.
-            if len(current_line_info[1]) == 1:
+            if tabs == 1:
                 # More than one tab on the line --> not mixed mode!
-                nb_space = (
-                    len(current_line_info[1]) *
-                    MAX_SPACES - len(previous_line_info[1])
-                )
+                nb_space = MAX_SPACES - previous_spaces
                 if MIN_SPACES <= nb_space <= MAX_SPACES:
-                    key = 'mixed%d' % nb_space
-                    self.lines[key] += 1
-                    return key
-
-        elif t == (LineType.tab_only, LineType.mixed):
-            (_, tab_part, space_part) = current_line_info
-            if len(previous_line_info[1]) == len(tab_part):
-                nb_space = len(space_part)
-                if MIN_SPACES <= nb_space <= MAX_SPACES:
-                    key = 'mixed%d' % nb_space
-                    self.lines[key] += 1
-                    return key
-
-        elif t == (LineType.mixed, LineType.tab_only):
-            (_, tab_part, space_part) = previous_line_info
-            if len(tab_part) + 1 == len(current_line_info[1]):
-                nb_space = MAX_SPACES - len(space_part)
+                    counts[MIXED_OFFSET + nb_space] += delta
+                    return MIXED_OFFSET + nb_space
+
+        elif previous_code == LineCode.mixed:
+            if previous_tabs + 1 == tabs:
+                nb_space = MAX_SPACES - previous_spaces
                 if MIN_SPACES <= nb_space <= MAX_SPACES:
-                    key = 'mixed%d' % nb_space
-                    self.lines[key] += 1
-                    return key
+                    counts[MIXED_OFFSET + nb_space] += delta
+                    return MIXED_OFFSET + nb_space
+
+    elif code == LineCode.space_only:
+        if (
+            previous_code == LineCode.space_only or
+            previous_code == LineCode.begin_space or
+            previous_code == LineCode.no_indent
+        ):
+            nb_space = spaces - previous_spaces
+            if MIN_SPACES <= nb_space <= MAX_SPACES:
+                counts[SPACE_OFFSET + nb_space] += delta
+                return SPACE_OFFSET + nb_space
+
+    elif code == LineCode.begin_space:
+        if (
+            previous_code == LineCode.begin_space or
+            previous_code == LineCode.no_indent
+        ):
+            nb_space = spaces - previous_spaces
+            if MIN_SPACES <= nb_space <= MAX_SPACES:
+                counts[SPACE_OFFSET + nb_space] += delta
+                counts[MIXED_OFFSET + nb_space] += delta
+                return SPACE_OFFSET + nb_space
+
+    elif code == LineCode.mixed:
+        if previous_code == LineCode.tab_only and previous_tabs == tabs:
+            nb_space = spaces
+            if MIN_SPACES <= nb_space <= MAX_SPACES:
+                counts[MIXED_OFFSET + nb_space] += delta
+                return MIXED_OFFSET + nb_space
+
+    return None
+
+
+class IncrementalIndentFinder(object):
+
+    """Keep the analysis of changing lines, like those of an editor buffer.
+
+    The classification of each line and the step it contributed to counts are
+    remembered, so that update() only reanalyses the changed lines and the
+    lines right after them, whose steps depend on the changed lines. Unlike
+    parse_file(), all lines are analysed, regardless of MAX_BYTES.
+
+    """
+
+    def __init__(self, lines=(), filename=''):
+        self.counts = [0] * len(COUNT_KEYS)
+
+        self.required_ending = _required_ending(filename)
+        self.required_ending_count = 0
+
+        # Per line: classify_line(), whether it ends with a backslash, which
+        # makes the next line skipped, whether it ends with required_ending
+        # and the (previous_line_info, line_info) step counted for it.
+        self._infos = []
+        self._continued = []
+        self._endings = []
+        self._steps = []
+
+        self.update(0, 0, lines)
+
+    @property
+    def lines(self):
+        """Return counts keyed like IndentFinder.lines."""
+        return dict(zip(COUNT_KEYS, self.counts))
+
+    def __len__(self):
+        return len(self._infos)
+
+    def update(self, start, end, new_lines):
+        """Replace lines start to end (excluded) with new_lines."""
+        new_lines = list(new_lines)
+        if not 0 <= start <= end <= len(self._infos):
+            raise IndexError('invalid line range %d-%d' % (start, end))
+
+        # The first line after the change depends on it, and so does each
+        # following line as long as the lines before it are skipped.
+        stale_end = end
+        if end < len(self._infos):
+            if new_lines:
+                skipped = _is_continued(new_lines[-1])
+            else:
+                skipped = start > 0 and self._continued[start - 1]
+            skipped = skipped or end > 0 and self._continued[end - 1]
+
+            stale_end = end + 1
+            while skipped and stale_end < len(self._infos):
+                skipped = self._continued[stale_end - 1]
+                stale_end += 1
+
+        for step in self._steps[start:stale_end]:
+            if step is not None:
+                count_indentation_step(self.counts, *step, delta=-1)
+        self.required_ending_count -= sum(self._endings[start:end])
+
+        infos = []
+        continued = []
+        endings = []
+        for line in new_lines:
+            if line[-1:] == '\n':
+                line = line[:-1]
+            infos.append(classify_line(line))
+            continued.append(line[-1:] == '\\')
+            endings.append(bool(
+                self.required_ending and
+                _line_ends_with(line, self.required_ending)))
+
+        self._infos[start:end] = infos
+        self._continued[start:end] = continued
+        self._endings[start:end] = endings
+        self._steps[start:end] = [None] * len(new_lines)
+        self.required_ending_count += sum(endings)
+
+        self._count_steps(start, stale_end + len(new_lines) - (end - start))
+
+    def _count_steps(self, start, end):
+        """Count steps of lines start to end (excluded)."""
+        # Find the line that the first one follows, skipping skipped lines.
+        previous = start - 1
+        while previous > 0 and self._continued[previous - 1]:
+            previous -= 1
+        if previous < 0:
+            previous_line_info = None
         else:
-            pass
+            previous_line_info = self._infos[previous]
+
+        for index in range(start, end):
+            line_info = self._infos[index]
+            if index > 0 and self._continued[index - 1]:
+                self._steps[index] = None
+                continue
+
+            if (
+                previous_line_info is not None and
+                line_info is not None and
+                count_indentation_step(self.counts,
+                                       previous_line_info,
+                                       line_info) is not None
+            ):
+                self._steps[index] = (previous_line_info, line_info)
+            else:
+                self._steps[index] = None
+            previous_line_info = line_info
 
-        return None
+    def results(self, default_tab_width, default_result):
+        """Return result like parse_file() would on the current lines."""
+        if self.required_ending and not self.required_ending_count:
+            return default_result
+
+        return _results_from_counts(self.counts,
+                                    default_tab_width=default_tab_width,
+                                    default_result=default_result)
+
+
+def _is_continued(line):
+    """Return True if line makes IndentFinder skip the next line."""
+    if line[-1:] == '\n':
+        line = line[:-1]
+    return line[-1:] == '\\'
+
+
+def max_increment(remaining_bytes):
+    """Return how much any count can grow within remaining_bytes.
+
+    A counted line holds at least an indentation character and a non-blank
+    character and is separated from the next one by a newline.
+
+    """
+    return max(0, remaining_bytes + 1) // 3
+
+
+def is_settled(counts, max_increment):
+    """Return True if results() cannot change when counts grow.
+
+    counts is IndentFinder.counts. Each count may grow by up to max_increment
+    independently. Like in results(), a smaller indentation only wins over a
+    larger one if it has 10% more lines.
+
+    """
+    if max(counts) <= max_increment:
+        # The leader must beat the growth of the others.
+        return False
+
+    space_counts = [counts[SPACE_OFFSET + i]
+                    for i in range(MIN_SPACES, MAX_SPACES + 1)]
+    mixed_counts = [counts[MIXED_OFFSET + i]
+                    for i in range(MIN_SPACES, MAX_SPACES + 1)]
+    tab_count = counts[TAB_INDEX]
+
+    result = _results_from_counts(counts,
+                                  default_tab_width=0,
+                                  default_result=None)
+    if result is None:
+        return False
+
+    (indent_type, indent_value) = result
+    if indent_type == IndentType.tab:
+        return (tab_count > max(space_counts) + max_increment and
+                tab_count > max(mixed_counts) + max_increment)
+
+    if indent_type == IndentType.space:
+        width = indent_value
+        leader = space_counts[width - MIN_SPACES]
+        if not (leader >= max(mixed_counts) + max_increment and
+                leader > tab_count + max_increment):
+            return False
+        others = space_counts
+        smallest = MIN_SPACES
+    else:
+        width = indent_value[1]
+        leader = mixed_counts[width - MIN_SPACES]
+        if not (leader >= tab_count + max_increment and
+                leader > max(space_counts) + max_increment):
+            return False
+        others = mixed_counts
+        # results() never reports mixed indentation of one space.
+        smallest = 2
+
+    for i in range(smallest, MAX_SPACES + 1):
+        count = others[i - MIN_SPACES] + max_increment
+        if i > width and not leader > int(count * 1.1):
+            return False
+        if i < width and not count <= int(leader * 1.1):
+            return False
+
+    return True
 
 
 def results(lines,
@@ -316,12 +1007,23 @@ def results(lines,
     => same or more lines with mixed than lines with tab only
     => same or more lines with mixed than lines with space only
 
+    """
+    return _results_from_counts([lines[key] for key in COUNT_KEYS],
+                                default_tab_width=default_tab_width,
+                                default_result=default_result)
+
+
+def _results_from_counts(counts, default_tab_width, default_result):
+    """Return results() of counts, in the order of COUNT_KEYS.
+
+    This saves building the dictionary of IndentFinder.lines for each file.
+
     """
     max_line_space = max(
-        [lines['space%d' % i] for i in range(MIN_SPACES, MAX_SPACES + 1)])
+        counts[SPACE_OFFSET + MIN_SPACES:SPACE_OFFSET + MAX_SPACES + 1])
     max_line_mixed = max(
-        [lines['mixed%d' % i] for i in range(MIN_SPACES, MAX_SPACES + 1)])
-    max_line_tab = lines['tab']
+        counts[MIXED_OFFSET + MIN_SPACES:MIXED_OFFSET + MAX_SPACES + 1])
+    max_line_tab = counts[TAB_INDEX]
 
     result = None
 
@@ -331,9 +1033,9 @@ def results(lines,
         indent_value = None
         for i in range(MAX_SPACES, MIN_SPACES - 1, -1):
             # Give a 10% threshold.
-            if lines['space%d' % i] > int(nb * 1.1):
+            if counts[SPACE_OFFSET + i] > int(nb * 1.1):
                 indent_value = i
-                nb = lines['space%d' % indent_value]
+                nb = counts[SPACE_OFFSET + i]
 
         if indent_value is not None:
             result = (IndentType.space, indent_value)
@@ -349,9 +1051,9 @@ def results(lines,
         indent_value = None
         for i in range(MAX_SPACES, 1, -1):
             # Give a 10% threshold.
-            if lines['mixed%d' % i] > int(nb * 1.1):
+            if counts[MIXED_OFFSET + i] > int(nb * 1.1):
                 indent_value = i
-                nb = lines['mixed%d' % indent_value]
+                nb = counts[MIXED_OFFSET + i]
 
         if indent_value is not None:
             result = (IndentType.mixed, (MAX_SPACES, indent_value))
@@ -359,6 +1061,79 @@ def results(lines,
     return result or default_result
 
 
+# Number of steps confidence() assumes it did not see, so that a result found
+# from a handful of lines is not trusted much.
+UNSEEN_STEPS = 5
+
+# Results at least this confident are trusted as they are by
+# aggregate_results() and shared across defaults by ResultCache.
+MIN_CONFIDENCE = 0.5
+
+
+def confidence(lines):
+    """Return how clearly results() was decided from lines, from 0 to 1.
+
+    lines is like IndentFinder.lines. The count of the result is compared
+    with the strongest of the counts that results() preferred it to, taking
+    into account the 10% threshold between widths. The difference is divided
+    by the count of the result plus UNSEEN_STEPS. A default result has a
+    confidence of 0.
+
+    """
+    return _confidence_from_counts([lines[key] for key in COUNT_KEYS])
+
+
+def _confidence_from_counts(counts):
+    """Return confidence() of counts, in the order of COUNT_KEYS."""
+    result = _results_from_counts(counts,
+                                  default_tab_width=0,
+                                  default_result=None)
+    if result is None:
+        return 0.
+
+    space_counts = [counts[SPACE_OFFSET + i]
+                    for i in range(MIN_SPACES, MAX_SPACES + 1)]
+    mixed_counts = [counts[MIXED_OFFSET + i]
+                    for i in range(MIN_SPACES, MAX_SPACES + 1)]
+    tab_count = counts[TAB_INDEX]
+
+    (indent_type, indent_value) = result
+    if indent_type == IndentType.tab:
+        leader = tab_count
+        rivals = [max(space_counts), max(mixed_counts)]
+    else:
+        if indent_type == IndentType.space:
+            width = indent_value
+            leader = space_counts[width - MIN_SPACES]
+            others = space_counts
+            smallest = MIN_SPACES
+
+            # Steps that could be either space or mixed indentation are
+            # counted as both, so only the steps that were counted as mixed
+            # alone weigh against spaces.
+            rivals = [tab_count,
+                      max(max(0, mixed - space)
+                          for (mixed, space) in zip(mixed_counts,
+                                                    space_counts))]
+        else:
+            width = indent_value[1]
+            leader = mixed_counts[width - MIN_SPACES]
+            others = mixed_counts
+            # results() never reports mixed indentation of one space.
+            smallest = 2
+
+            rivals = [tab_count, max(space_counts)]
+
+        # A smaller width needs 10% more steps to win over a larger one.
+        for i in range(smallest, MAX_SPACES + 1):
+            if i > width:
+                rivals.append(others[i - MIN_SPACES] * 1.1)
+            elif i < width:
+                rivals.append(others[i - MIN_SPACES] / 1.1)
+
+    return max(0., leader - max(rivals)) / (leader + UNSEEN_STEPS)
+
+
 def results_to_string(result_data):
     (indent_type, indent_value) = result_data
     if indent_type != IndentType.mixed:
@@ -386,128 +1161,2089 @@ def vim_output(result_data, default_tab_width):
                 (tab_indent, space_indent, indent_type, space_indent))
 
 
-def forcefully_read_lines(filename, size):
-    """Return lines from file.
+def forcefully_read_lines(filename, size, windows=1):
+    """Return lines from file, as read by read_bytes().
 
     Ignore UnicodeDecodeErrors.
 
     """
-    input_file = open(filename, mode='rb')
+    return decode_lines(read_bytes(filename, size, windows=windows))
+
+
+# Line boundaries of str.splitlines() other than '\r' and '\n', as UTF-8.
+# bytes.splitlines() does not know about them.
+UNICODE_LINE_BOUNDARIES = [
+    b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e',
+    b'\xc2\x85', b'\xe2\x80\xa8', b'\xe2\x80\xa9',
+]
+
+
+def read_lines(filename, size, windows=1, buffer=None):
+    """Return lines of the first size bytes of file, decoded only if needed.
+
+    The result is equivalent to forcefully_read_lines() but lines are
+    undecoded bytes. Lines are only decoded if the file contains line
+    boundaries that bytes.splitlines() does not know about.
+
+    The file is read into buffer, a bytearray of at least size bytes, if it
+    is given, so that reading many files does not allocate a buffer for each.
+
+    Files larger than size are sampled with windows windows, like
+    read_bytes() does.
+
+    """
+    import io
+    import stat
+
+    # Python 2 files only read into a memoryview with the io module.
+    input_file = io.open(filename, mode='rb')
     try:
-        return input_file.read(size).decode('utf-8', 'replace').splitlines()
+        status = os.fstat(input_file.fileno())
+        file_size = status.st_size
+        if not file_size and stat.S_ISREG(status.st_mode):
+            # Reading would still allocate a buffer of size bytes.
+            return []
+
+        if windows > 1 and file_size > size:
+            return split_byte_lines(_read_windows(input_file, file_size,
+                                                  size=size,
+                                                  windows=windows))
+
+        if buffer is None:
+            # Special files have no size.
+            buffer = bytearray(min(size, file_size) or size)
+
+        # Rather than a memory map, which would turn the truncation of the
+        # file while it is analysed into a SIGBUS.
+        view = memoryview(buffer)[:size]
+        try:
+            data = view[:input_file.readinto(view)].tobytes()
+        finally:
+            view.release()
     finally:
         input_file.close()
-    return []
 
+    if _contains_any(data, UNICODE_LINE_BOUNDARIES + [b'\r']):
+        return split_byte_lines(data)
 
-def analyse_line_type(line):
-    """Analyse the type of line.
+    # Lines keep their '\n'. They are read one at a time rather than all
+    # split up front.
+    return iter(io.BytesIO(data).readline, b'')
 
-    Return (LineType, <indentation part of the line>).
 
-    The function will reject improperly formatted lines (mixture of tab
-    and space for example) and comment lines.
+def split_byte_lines(data):
+    """Return lines of data like decode_lines(), undecoded if possible."""
+    if _contains_any(data, UNICODE_LINE_BOUNDARIES):
+        return decode_lines(data)
+    return data.splitlines()
 
-    """
-    mixed_mode = False
-    tab_part = ''
-    space_part = ''
 
-    if line and line[0] != ' ' and line[0] != '\t':
-        return (LineType.no_indent, '')
+def _contains_any(data, patterns):
+    """Return True if bytes or mmap data contains one of patterns."""
+    for pattern in patterns:
+        # Looking for a single byte first is much faster, and the last bytes of
+        # multibyte patterns are rare.
+        if data.find(pattern[-1:]) != -1 and data.find(pattern) != -1:
+            return True
+    return False
 
-    mo = INDENT_RE.match(line)
-    if not mo:
-        return None
 
-    indent_part = mo.group(1)
-    text_part = mo.group(2)
+def read_bytes(filename, size, windows=1):
+    """Return up to size bytes from the beginning of file.
 
-    if text_part[0] == '*':
-        # Continuation of a C/C++ comment, unlikely to be indented
-        # correctly.
-        return None
+    If windows is more than 1 and the file is larger than size, the bytes are
+    instead sampled from that many windows spread evenly across the file, see
+    _read_windows().
 
-    if text_part[0:2] == '/*' or text_part[0] == '#':
-        # Python, C/C++ comment, might not be indented correctly.
-        return None
+    """
+    input_file = open(filename, mode='rb')
+    try:
+        if windows > 1:
+            file_size = os.fstat(input_file.fileno()).st_size
+            if file_size > size:
+                return _read_windows(input_file, file_size,
+                                     size=size,
+                                     windows=windows)
+        return input_file.read(size)
+    finally:
+        input_file.close()
 
-    if '\t' in indent_part and ' ' in indent_part:
-        # Mixed mode.
-        mo = MIXED_RE.match(indent_part)
-        if not mo:
-            # Line is not composed of '\t\t\t    ', ignore it.
-            return None
-        mixed_mode = True
-        tab_part = mo.group(1)
-        space_part = mo.group(2)
 
-    if mixed_mode:
-        if len(space_part) >= MAX_SPACES:
-            # This is not mixed mode, this is garbage!
-            return None
-        return (LineType.mixed, tab_part, space_part)
+# Separates the windows of _read_windows(). The first empty line ends any
+# continuation and the next ones the line before them, so that no indentation
+# step is counted across a gap, even if a window ends with '\r'.
+_WINDOW_GAP = b'\n\n\n'
 
-    if '\t' in indent_part:
-        return (LineType.tab_only, indent_part)
 
-    assert ' ' in indent_part
+def _read_windows(input_file, file_size, size, windows):
+    """Return at most size bytes of windows spread evenly across input_file.
 
-    if len(indent_part) < MAX_SPACES:
-        # This could be mixed mode too.
-        return (LineType.begin_space, indent_part)
-    else:
-        # This is really a line indented with spaces.
-        return (LineType.space_only, indent_part)
+    The first window starts the file and the last one ends it. Each window is
+    cut to the whole lines in it, so lines are never analysed from their
+    middle, and windows are joined with _WINDOW_GAP.
 
+    """
+    window_size = size // windows
+    parts = []
+    for index in range(windows):
+        offset = index * (file_size - window_size) // (windows - 1)
+        input_file.seek(offset)
+        data = input_file.read(window_size)
 
-def main():
-    parser = optparse.OptionParser(
-        version='indent-finder %s' % (__version__,))
+        if offset:
+            # Skip the end of the line that began before the window.
+            data = data[_first_line_start(data):]
 
-    parser.add_option('--vim-output', action='store_true',
-                      help='output suitable to use inside vim')
-    parser.add_option('--default-tab-width', type=int,
-                      default=8,
-                      help='default tab width (%default)')
-    parser.add_option('--default-spaces', type=int,
-                      default=4,
-                      help='default indentation width (%default)')
-    parser.add_option('--default-to-tabs', action='store_true',
-                      help='default to tabs')
+        if offset + window_size < file_size:
+            # Drop the beginning of the line that goes on after the window.
+            data = data[:max(data.rfind(b'\n'), data.rfind(b'\r')) + 1]
 
-    (options, args) = parser.parse_args()
+        parts.append(data)
 
-    if options.default_to_tabs:
-        default_result = (IndentType.tab, options.default_tab_width)
-    else:
-        default_result = (IndentType.space, options.default_spaces)
+    return _WINDOW_GAP.join(parts)
 
-    for filename in args:
-        try:
-            result_data = parse_file(
-                filename,
-                default_tab_width=options.default_tab_width,
-                default_result=default_result)
 
-            if options.vim_output:
-                output = vim_output(
-                    result_data,
-                    default_tab_width=options.default_tab_width)
-            else:
-                output = results_to_string(result_data) + '\n'
+def _first_line_start(data):
+    """Return the index following the first line break of data."""
+    positions = [position
+                 for position in (data.find(b'\n'), data.find(b'\r'))
+                 if position != -1]
+    if not positions:
+        return len(data)
+    return min(positions) + 1
 
-            if len(args) > 1:
-                output = filename + ' : ' + output.rstrip() + '\n'
 
-            sys.stdout.write(output)
-        except IOError:
-            # Only print error message in non-Vim mode. Otherwise, we will be
-            # passing garbage to Vim.
-            if not options.vim_output:
-                sys.stderr.write('%s\n' % (sys.exc_info()[1],))
+def decode_lines(data):
+    """Return lines of UTF-8 encoded data, ignoring UnicodeDecodeErrors."""
+    return data.decode('utf-8', 'replace').splitlines()
+
+
+_NO_INDENT_INFO = (LineCode.no_indent, 0, 0)
+
+# Line infos of common indentations are shared, so that classify_line() does
+# not allocate a tuple for most lines. Wider ones are allocated as needed.
+_MAX_SHARED_WIDTH = 64
+
+_BEGIN_SPACE_INFOS = [(LineCode.begin_space, 0, spaces)
+                      for spaces in range(MAX_SPACES)]
+_SPACE_ONLY_INFOS = [(LineCode.space_only, 0, spaces)
+                     for spaces in range(_MAX_SHARED_WIDTH)]
+_TAB_ONLY_INFOS = [(LineCode.tab_only, tabs, 0)
+                   for tabs in range(_MAX_SHARED_WIDTH)]
+_MIXED_INFOS = [[(LineCode.mixed, tabs, spaces)
+                 for spaces in range(MAX_SPACES)]
+                for tabs in range(_MAX_SHARED_WIDTH)]
+
+
+def _make_line_classifier(characters, newline=None):
+    """Return classify_line() for lines of the type of characters.
+
+    characters holds space, tab, '*', '#' and '/' as str or as bytes, so that
+    bytes lines are classified without being decoded. Only slices of lines are
+    compared since indexing bytes returns integers. If newline is given, lines
+    may end with it, which saves a copy of each line to remove it.
+
+    """
+    space = characters[0:1]
+    tab = characters[1:2]
+    indentation = characters[0:2]
+    star = characters[2:3]
+    hash_mark = characters[3:4]
+    slash = characters[4:5]
+
+    begin_space_infos = _BEGIN_SPACE_INFOS
+    space_only_infos = _SPACE_ONLY_INFOS
+    tab_only_infos = _TAB_ONLY_INFOS
+    mixed_infos = _MIXED_INFOS
+
+    def classify_line(line):
+        """Classify the indentation of line without regular expressions.
+
+        Return (LineCode, number of tabs, number of spaces) or None. The line
+        is rejected in the same cases as analyse_line_type().
+
+        """
+        if not line or line == newline:
+            return None
+
+        first = line[:1]
+        if first != space and first != tab:
+            return _NO_INDENT_INFO
+
+        text = line.lstrip(indentation)
+        if not text or text == newline:
+            return None
+
+        first = text[:1]
+        if first == star or first == hash_mark:
+            # Python, C/C++ comment or continuation of a C/C++ comment, might
+            # not be indented correctly.
+            return None
+
+        if first == slash and text[1:2] == star:
+            return None
+
+        width = len(line) - len(text)
+        tabs = line.count(tab, 0, width)
+
+        if not tabs:
+            if width < MAX_SPACES:
+                # This could be mixed mode too.
+                return begin_space_infos[width]
+            elif width < _MAX_SHARED_WIDTH:
+                # This is really a line indented with spaces.
+                return space_only_infos[width]
+            return (LineCode.space_only, 0, width)
+
+        if tabs == width:
+            if tabs < _MAX_SHARED_WIDTH:
+                return tab_only_infos[tabs]
+            return (LineCode.tab_only, tabs, 0)
+
+        # Mixed mode.
+        if line.count(tab, 0, tabs) != tabs:
+            # Line is not composed of '\t\t\t    ', ignore it.
+            return None
+
+        spaces = width - tabs
+        if spaces >= MAX_SPACES:
+            # This is not mixed mode, this is garbage!
+            return None
+
+        if tabs < _MAX_SHARED_WIDTH:
+            return mixed_infos[tabs][spaces]
+        return (LineCode.mixed, tabs, spaces)
+
+    return classify_line
+
+
+classify_line = _make_line_classifier(' \t*#/')
+classify_bytes_line = _make_line_classifier(b' \t*#/', newline=b'\n')
+
+
+def _import_accelerator():
+    """Return the _indent_finder module, or None if it cannot be used.
+
+    This optional C extension is built by setup.py next to this file. Its
+    functions behave like their pure Python counterparts, and it is not used
+    if its copies of the constants they depend on differ from ours. Setting
+    INDENT_FINDER_PURE_PYTHON in the environment disables it.
+
+    """
+    if os.environ.get('INDENT_FINDER_PURE_PYTHON'):
+        return None
+
+    try:
+        import _indent_finder
+    except ImportError:
+        return None
+
+    for (name, value) in _accelerator_constants().items():
+        if getattr(_indent_finder, name, None) != value:
+            return None
+
+    return _indent_finder
+
+
+def _accelerator_constants():
+    """Return the constants that the accelerator must share with us."""
+    return {'MAX_SPACES': MAX_SPACES,
+            'MAX_SHARED_WIDTH': _MAX_SHARED_WIDTH,
+            'NO_INDENT': LineCode.no_indent,
+            'SPACE_ONLY': LineCode.space_only,
+            'TAB_ONLY': LineCode.tab_only,
+            'MIXED': LineCode.mixed,
+            'BEGIN_SPACE': LineCode.begin_space}
+
+
+_accelerator = _import_accelerator()
+if _accelerator is not None:
+    classify_bytes_line = _accelerator.classify_bytes_line
+    # Python 2 only accelerates bytes lines.
+    classify_line = getattr(_accelerator, 'classify_line', classify_line)
+
+
+def analyse_line_type(line):
+    """Analyse the type of line.
+
+    Return (LineType, <indentation part of the line>), or for mixed lines
+    (LineType.mixed, <tab part>, <space part>).
+
+    The function will reject improperly formatted lines (mixture of tab
+    and space for example) and comment lines. classify_line() is the faster
+    equivalent used by IndentFinder.
+
+    """
+    info = classify_line(line)
+    if info is None:
+        return None
+
+    (code, tabs, spaces) = info
+    if code == LineCode.mixed:
+        return (LINE_TYPES[code], '\t' * tabs, ' ' * spaces)
+    return (LINE_TYPES[code], '\t' * tabs + ' ' * spaces)
+
+
+DEFAULT_CACHE_SIZE = 100000
+
+
+def default_cache_path():
+    """Return path of the cache file used by --cache."""
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(directory, 'indent-finder', 'results.sqlite3')
+
+
+class ResultCache(object):
+
+    """Results stored on disk across invocations.
+
+    Entries are kept in an SQLite database so that several processes can read
+    and write the cache at the same time. Once there are more than max_size
+    entries, the least recently used ones are evicted.
+
+    A file entry is keyed by the absolute path of the file and the options
+    that affect its result. It remembers the modification time and size of
+    the file, so that a file that did not change is answered without reading
+    it, and a digest of the analysed bytes, so that a file that was only
+    touched is not analysed again. Results of at least MIN_CONFIDENCE do not
+    depend on the default result, so their entries are shared by all default
+    results.
+
+    hits, misses and evictions count what happened through this instance.
+
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        import sqlite3
+
+        self.path = path
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have just created it.
+                if not os.path.isdir(directory):
+                    raise
+
+        # Autocommit mode keeps each statement atomic without holding locks
+        # between statements. Writers wait on each other thanks to timeout.
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           isolation_level=None)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, '
+            'stat TEXT, '
+            'digest TEXT, '
+            'result TEXT, '
+            'last_used REAL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS results_last_used '
+            'ON results (last_used)')
+
+    def close(self):
+        self._connection.close()
+
+    def get(self, key):
+        """Return (stat, digest, result_data) stored for key or None."""
+        row = self._connection.execute(
+            'SELECT stat, digest, result FROM results WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+
+        (stat, digest, result) = row
+        return (stat, digest, _result_from_json(result))
+
+    def touch(self, key, stat=None):
+        """Mark key as recently used, updating its stat if given."""
+        import time
+
+        if stat is None:
+            self._connection.execute(
+                'UPDATE results SET last_used = ? WHERE key = ?',
+                (time.time(), key))
+        else:
+            self._connection.execute(
+                'UPDATE results SET last_used = ?, stat = ? WHERE key = ?',
+                (time.time(), stat, key))
+
+    def put(self, key, stat, digest, result_data):
+        """Store result_data for key, evicting old entries if needed."""
+        import json
+        import time
+
+        self._connection.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+            (key, stat, digest, json.dumps(result_data), time.time()))
+
+        (size,) = self._connection.execute(
+            'SELECT COUNT(*) FROM results').fetchone()
+        if size > self.max_size:
+            self.evictions += self._connection.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                (size - self.max_size,)).rowcount
+
+    def parse_file(self, finder, filename, default_tab_width,
+                   default_result, early_exit=False, measure=False):
+        """Return result like _parse_file(), using the cache if possible."""
+        import hashlib
+
+        finder.lines_saved = 0
+        finder.evidence = None
+        finder.lines_examined = finder.bytes_examined = 0
+
+        result_data = _preset_result(filename,
+                                     default_tab_width=default_tab_width,
+                                     default_result=default_result)
+        if result_data is not None:
+            return result_data
+
+        options = (__version__, MAX_BYTES, SAMPLE_WINDOWS, default_tab_width)
+        key = '%s\0%r' % (os.path.abspath(filename),
+                          options + (default_result,))
+        # Results of at least MIN_CONFIDENCE were not defaulted, so they are
+        # stored without default_result and reused whatever it is.
+        confident_key = '%s\0%r' % (os.path.abspath(filename), options)
+
+        status = os.stat(filename)
+        stat = '%r:%d' % (getattr(status, 'st_mtime_ns', status.st_mtime),
+                          status.st_size)
+
+        entries = [(confident_key, self.get(confident_key)),
+                   (key, self.get(key))]
+        for (entry_key, entry) in entries:
+            if entry is not None and entry[0] == stat:
+                self.hits += 1
+                self.touch(entry_key)
+                return entry[2]
+
+        data = read_bytes(filename, MAX_BYTES, windows=SAMPLE_WINDOWS)
+        digest = hashlib.sha1(data).hexdigest()
+
+        for (entry_key, entry) in entries:
+            if entry is not None and entry[1] == digest:
+                self.hits += 1
+                self.touch(entry_key, stat=stat)
+                return entry[2]
+
+        self.misses += 1
+        result_data = _parse_lines(finder, filename, split_byte_lines(data),
+                                   default_tab_width=default_tab_width,
+                                   default_result=default_result,
+                                   early_exit=early_exit,
+                                   budget=len(data),
+                                   measure=measure)
+        if _confidence_from_counts(finder.evidence) >= MIN_CONFIDENCE:
+            self.put(confident_key, stat, digest, result_data)
+        else:
+            self.put(key, stat, digest, result_data)
+        return result_data
+
+    def parse_blob(self, finder, filename, blob_id, read_blob,
+                   default_tab_width, default_result, early_exit=False):
+        """Return result like _parse_file() of a git blob named filename.
+
+        A blob id identifies its content, so read_blob(), which returns the
+        bytes to analyse, is only called if the blob was never analysed with
+        the rules of filename before.
+
+        """
+        import io
+
+        finder.lines_saved = 0
+        finder.evidence = None
+
+        result_data = _preset_result(filename,
+                                     default_tab_width=default_tab_width,
+                                     default_result=default_result)
+        if result_data is not None:
+            return result_data
+
+        key = 'git-blob:%s\0%r' % (
+            blob_id,
+            (__version__, MAX_BYTES, default_tab_width, default_result,
+             _required_ending(filename)))
+
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.touch(key)
+            return entry[2]
+
+        self.misses += 1
+        result_data = _parse_file(finder, filename,
+                                  default_tab_width=default_tab_width,
+                                  default_result=default_result,
+                                  early_exit=early_exit,
+                                  input_file=io.BytesIO(read_blob()))
+        self.put(key, None, blob_id, result_data)
+        return result_data
+
+
+def _result_from_json(text):
+    """Return result data from its JSON form, with tuples restored."""
+    import json
+
+    (indent_type, indent_value) = json.loads(text)
+    if isinstance(indent_value, list):
+        indent_value = tuple(indent_value)
+    return (indent_type, indent_value)
+
+
+# Directories that are never walked into.
+IGNORED_DIRECTORIES = ['.git']
+
+IGNORE_FILENAME = '.gitignore'
+
+
+class IgnoreRules(object):
+
+    """Patterns in the style of .gitignore, applied while walking.
+
+    Patterns without a slash match the name of a file or directory at any
+    depth below the directory they were declared in. Other patterns are
+    anchored to that directory. A trailing slash only matches directories, a
+    leading '!' re-includes what an earlier pattern excluded and '**' matches
+    any number of directories. The last matching pattern wins.
+
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    def extended(self, base, patterns):
+        """Return new rules that also include patterns declared in base.
+
+        base may be None for patterns declared in each directory that
+        walk_files() walks, like those given with --exclude.
+
+        """
+        rules = list(self.rules)
+        for pattern in patterns:
+            pattern = pattern.rstrip('\n\r')
+            if not pattern.strip() or pattern.startswith('#'):
+                continue
+
+            pattern = pattern.rstrip(' ')
+
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+
+            if '/' in pattern:
+                regex = _glob_to_regex(pattern.lstrip('/'))
+            else:
+                regex = '(?:.*/)?' + _glob_to_regex(pattern)
+
+            import re
+            rules.append((base, re.compile(regex + '$'), negated,
+                          directory_only))
+
+        return IgnoreRules(rules)
+
+    def anchored(self, directory):
+        """Return rules whose patterns without a base are declared in it."""
+        return IgnoreRules(
+            [(directory if base is None else base,
+              regex, negated, directory_only)
+             for (base, regex, negated, directory_only) in self.rules])
+
+    def extended_from_file(self, directory):
+        """Return rules extended with the ignore file of directory, if any."""
+        try:
+            input_file = open(os.path.join(directory, IGNORE_FILENAME))
+        except IOError:
+            return self
+
+        try:
+            return self.extended(directory, input_file.readlines())
+        finally:
+            input_file.close()
+
+    def is_ignored(self, path, is_directory):
+        ignored = False
+        for (base, regex, negated, directory_only) in self.rules:
+            if base is None or (directory_only and not is_directory):
+                # Patterns without a base only apply once anchored().
+                continue
+
+            relative_path = os.path.relpath(path, base).replace(os.sep, '/')
+            if relative_path.startswith('../'):
+                continue
+
+            if regex.match(relative_path):
+                ignored = not negated
+
+        return ignored
+
+
+def _glob_to_regex(pattern):
+    """Return regular expression equivalent to a .gitignore glob."""
+    import re
+
+    regex = ''
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index):
+            regex += '(?:.*/)?'
+            index += 3
+        elif pattern.startswith('**', index):
+            regex += '.*'
+            index += 2
+        elif pattern[index] == '*':
+            regex += '[^/]*'
+            index += 1
+        elif pattern[index] == '?':
+            regex += '[^/]'
+            index += 1
+        elif pattern[index] == '[':
+            # A leading '!' negates the class like '^' does in regular
+            # expressions, and a ']' right after either is part of it.
+            start = index + 1
+            negated = pattern.startswith('!', start)
+            if negated:
+                start += 1
+
+            end = pattern.find(']', start + 1)
+            if end == -1:
+                regex += re.escape('[')
+                index += 1
+            else:
+                regex += ('[' + ('^' if negated else '') +
+                          pattern[start:end].replace('\\', '\\\\') + ']')
+                index = end + 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+    return regex
+
+
+def walk_files(paths, ignore_rules=None, extensions=None):
+    """Yield files to analyse, walking into directories.
+
+    Files given explicitly are always yielded. Files found in directories are
+    skipped if they match ignore_rules or an ignore file, or if extensions is
+    given and they do not end with one of them. Files are yielded as soon as
+    they are found, those of a directory before those of its subdirectories.
+
+    """
+    if ignore_rules is None:
+        ignore_rules = IgnoreRules()
+
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in _walk_directory(path,
+                                            ignore_rules.anchored(path),
+                                            extensions):
+                yield filename
+        else:
+            yield path
+
+
+def _walk_directory(directory, ignore_rules, extensions):
+    ignore_rules = ignore_rules.extended_from_file(directory)
+
+    try:
+        entries = _list_directory(directory)
+    except OSError:
+        # Like os.walk(), silently skip directories that cannot be listed.
+        return
+
+    subdirectories = []
+    for (name, path, is_directory) in entries:
+        if is_directory:
+            if (
+                name not in IGNORED_DIRECTORIES and
+                not ignore_rules.is_ignored(path, is_directory=True)
+            ):
+                subdirectories.append(path)
+            continue
+
+        if extensions and not name.endswith(tuple(extensions)):
+            continue
+
+        if ignore_rules.is_ignored(path, is_directory=False):
+            continue
+
+        yield path
+
+    for path in subdirectories:
+        for filename in _walk_directory(path, ignore_rules, extensions):
+            yield filename
+
+
+def _list_directory(directory):
+    """Return sorted (name, path, is_directory) of the entries of directory.
+
+    Symbolic links to directories are not directories. Entries whose type
+    cannot be determined are left out.
+
+    """
+    entries = []
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(directory):
+            try:
+                is_directory = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append((entry.name, entry.path, is_directory))
+    else:
+        # Python 2 has no os.scandir().
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            is_directory = os.path.isdir(path) and not os.path.islink(path)
+            entries.append((name, path, is_directory))
+
+    entries.sort()
+    return entries
+
+
+def iterate_git_results(revision, paths, default_tab_width, default_result,
+                        repository=None, extensions=None, cache=None,
+                        early_exit=False):
+    """Return iterator of (path, result_data, error_message) at revision.
+
+    Files are listed with git ls-tree, restricted to paths if given, and read
+    from the object store of the repository, the current directory by
+    default, without checking anything out. Symbolic links and submodules are
+    skipped, and so are files that do not end with one of extensions if it is
+    given. If cache is a ResultCache, blobs that were already analysed are not
+    read again.
+
+    Raise IOError right away if git fails to list the files, for example if
+    revision does not exist.
+
+    """
+    import subprocess
+
+    process = subprocess.Popen(
+        ['git', 'ls-tree', '-r', '-z', revision, '--'] + list(paths),
+        cwd=repository,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    (output, error) = process.communicate()
+    if process.returncode:
+        raise IOError(error.decode('utf-8', 'replace').strip())
+
+    return _iterate_git_blobs(output,
+                              default_tab_width=default_tab_width,
+                              default_result=default_result,
+                              repository=repository,
+                              extensions=extensions,
+                              cache=cache,
+                              early_exit=early_exit)
+
+
+def _iterate_git_blobs(tree, default_tab_width, default_result, repository,
+                       extensions, cache, early_exit):
+    """Yield results of the blobs of tree, the output of git ls-tree -z."""
+    import io
+
+    finder = IndentFinder()
+    reader = None
+    try:
+        for entry in tree.split(b'\0'):
+            if not entry:
+                continue
+
+            (information, path) = entry.split(b'\t', 1)
+            (mode, object_type, blob_id) = information.decode().split()
+            if object_type != 'blob' or mode == '120000':
+                continue
+
+            path = path.decode('utf-8', 'replace')
+            if extensions and not path.endswith(tuple(extensions)):
+                continue
+
+            if reader is None:
+                reader = _GitBlobReader(repository)
+
+            def read_blob():
+                return reader.read(blob_id, MAX_BYTES)
+
+            if cache is None:
+                result_data = _parse_file(
+                    finder, path,
+                    default_tab_width=default_tab_width,
+                    default_result=default_result,
+                    early_exit=early_exit,
+                    input_file=io.BytesIO(read_blob()))
+            else:
+                result_data = cache.parse_blob(
+                    finder, path, blob_id, read_blob,
+                    default_tab_width=default_tab_width,
+                    default_result=default_result,
+                    early_exit=early_exit)
+
+            yield (path, result_data, None)
+    finally:
+        if reader is not None:
+            reader.close()
+
+
+class _GitBlobReader(object):
+
+    """Read blobs through one long-lived git cat-file --batch process.
+
+    The process is only started on the first read.
+
+    """
+
+    def __init__(self, repository=None):
+        self.repository = repository
+        self._process = None
+
+    def read(self, blob_id, size):
+        """Return up to size bytes from the beginning of blob_id."""
+        import subprocess
+
+        if self._process is None:
+            self._process = subprocess.Popen(
+                ['git', 'cat-file', '--batch'],
+                cwd=self.repository,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+
+        self._process.stdin.write(blob_id.encode() + b'\n')
+        self._process.stdin.flush()
+
+        header = self._process.stdout.readline().split()
+        if len(header) != 3:
+            raise IOError('cannot read blob %s' % (blob_id,))
+        blob_size = int(header[2])
+
+        data = self._process.stdout.read(min(size, blob_size))
+
+        # Skip the rest of the blob and the newline that ends it.
+        remaining = blob_size - len(data) + 1
+        while remaining:
+            chunk = self._process.stdout.read(min(remaining, 65536))
+            if not chunk:
+                raise IOError('cannot read blob %s' % (blob_id,))
+            remaining -= len(chunk)
+
+        return data
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+
+def format_output(filename, result_data, vim, default_tab_width,
+                  evidence=None):
+    """Return result formatted for the command line or for Vim.
+
+    filename is prefixed unless it is None. If evidence is given, as yielded
+    by iterate_results() with with_evidence, the confidence() of the result
+    is appended to the command-line format.
+
+    """
+    if vim:
+        output = vim_output(result_data, default_tab_width=default_tab_width)
+    elif evidence is None:
+        output = results_to_string(result_data) + '\n'
+    else:
+        output = '%s (confidence %.2f)\n' % (
+            results_to_string(result_data),
+            _confidence_from_counts(evidence))
+
+    if filename is not None:
+        output = filename + ' : ' + output.rstrip() + '\n'
+
+    return output
+
+
+def vim_batch_output(filename, result_data, default_tab_width):
+    """Return a line of JSON [filename, settings] for the vim plugin.
+
+    settings is vim_output() of result_data, or an empty string if the file
+    could not be read and result_data is None.
+
+    """
+    import json
+
+    if result_data is None:
+        settings = ''
+    else:
+        settings = vim_output(result_data, default_tab_width=default_tab_width)
+    return json.dumps([filename, settings]) + '\n'
+
+
+def json_output(filename, result_data, error_message, evidence, counters):
+    """Return a line of JSON describing the analysis of a file.
+
+    evidence and counters are as yielded by iterate_results() with
+    with_evidence and with_counters. The object has the filename, the result
+    as formatted by results_to_string(), its confidence(), the counts keyed
+    like IndentFinder.lines, the number of lines and bytes examined, the
+    seconds the analysis took and the error message. result, confidence and
+    counts are null if there are none, like for files whose name decides the
+    result.
+
+    """
+    import json
+
+    if result_data is None:
+        result = None
+    else:
+        result = results_to_string(result_data)
+
+    if evidence is None:
+        counts = None
+        result_confidence = None
+    else:
+        counts = dict(zip(COUNT_KEYS, evidence))
+        result_confidence = _confidence_from_counts(evidence)
+
+    return json.dumps({'filename': filename,
+                       'result': result,
+                       'confidence': result_confidence,
+                       'counts': counts,
+                       'lines': counters.get('lines examined', 0),
+                       'bytes': counters.get('bytes examined', 0),
+                       'seconds': counters.get('seconds', 0.),
+                       'error': error_message},
+                      sort_keys=True) + '\n'
+
+
+def serve(input_file, output_file, default_tab_width, default_result, vim):
+    """Answer detection requests until input_file is exhausted.
+
+    Each request is a line holding a JSON message of the form
+    [id, {"filename": filename}], as sent by Vim's channel in JSON mode. If
+    the request also has "lines", a list of strings like the lines of an
+    editor buffer, they are analysed instead of the content of the file. Each
+    response is the line [id, output], where output is the formatted result
+    without the trailing newline, or an empty string if the file could not be
+    read.
+
+    A single IndentFinder is kept for the whole session so that only the first
+    request pays for interpreter startup.
+
+    """
+    import io
+    import json
+
+    # The type of strings decoded by json, which is unicode on Python 2.
+    text_type = type(u'')
+
+    finder = IndentFinder()
+    while True:
+        line = input_file.readline()
+        if not line:
+            break
+
+        if not line.strip():
+            continue
+
+        try:
+            (request_id, request) = json.loads(line)
+            filename = request['filename']
+            if not isinstance(filename, text_type):
+                raise TypeError('filename must be a string')
+
+            if 'lines' in request:
+                lines = request['lines']
+                if not isinstance(lines, list) or not all(
+                        isinstance(item, text_type) for item in lines):
+                    raise TypeError('lines must be a list of strings')
+
+                data = '\n'.join(lines).encode('utf-8', 'replace')
+                content_file = io.BytesIO(data[:MAX_BYTES])
+            else:
+                content_file = None
+        except (ValueError, TypeError, KeyError):
+            # Skip malformed requests rather than killing the session.
+            continue
+
+        try:
+            result_data = _parse_file(
+                finder,
+                filename=filename,
+                default_tab_width=default_tab_width,
+                default_result=default_result,
+                input_file=content_file)
+            output = format_output(None, result_data,
+                                   vim=vim,
+                                   default_tab_width=default_tab_width)
+        except IOError:
+            output = ''
+
+        output_file.write(json.dumps([request_id, output.rstrip('\n')]) +
+                          '\n')
+        output_file.flush()
+
+
+# Upper bound on the number of files sent to a worker at once.
+MAX_CHUNK_SIZE = 64
+
+# State of the current worker process. See _initialize_worker().
+_worker_options = {}
+
+
+def _initialize_worker(default_tab_width, default_result, early_exit=False,
+                       cache_path=None, cache_size=None, measure=False,
+                       profile=False):
+    if profile:
+        _worker_options['finder'] = ProfilingIndentFinder()
+    else:
+        _worker_options['finder'] = IndentFinder()
+    _worker_options['default_tab_width'] = default_tab_width
+    _worker_options['default_result'] = default_result
+    _worker_options['early_exit'] = early_exit
+    _worker_options['measure'] = measure
+
+    if cache_path is None:
+        _worker_options['cache'] = None
+    else:
+        _worker_options['cache'] = ResultCache(cache_path,
+                                               max_size=cache_size)
+
+
+def _parse_file_in_worker(filename):
+    """Return (filename, result_data, error_message, counters, evidence).
+
+    Exceptions are turned into messages since they do not survive the trip
+    back to the parent process as-is. counters maps names of counters, like
+    'lines saved' or 'cache hits', to what this file added to them. If files
+    are measured, they include 'lines examined', 'bytes examined' and
+    'seconds', the time the analysis of this file took. If files are
+    profiled, they include those of PROFILE_COUNTERS. evidence is the
+    finder.evidence of the file, or None.
+
+    """
+    finder = _worker_options['finder']
+    cache = _worker_options['cache']
+    measure = _worker_options['measure']
+    if cache is None:
+        parse = _parse_file
+    else:
+        parse = cache.parse_file
+
+    if measure:
+        import timeit
+        start = timeit.default_timer()
+
+    try:
+        item = (filename,
+                parse(finder,
+                      filename=filename,
+                      default_tab_width=_worker_options['default_tab_width'],
+                      default_result=_worker_options['default_result'],
+                      early_exit=_worker_options['early_exit'],
+                      measure=measure),
+                None)
+    except (IOError, OSError):
+        item = (filename, None, '%s' % (sys.exc_info()[1],))
+        finder.evidence = None
+
+    counters = {}
+    if measure:
+        counters['seconds'] = timeit.default_timer() - start
+        counters['lines examined'] = finder.lines_examined
+        counters['bytes examined'] = finder.bytes_examined
+
+    if finder.counters is not None:
+        counters.update(finder.counters)
+        finder.reset_counters()
+
+    if _worker_options['early_exit']:
+        counters['lines saved'] = finder.lines_saved
+        finder.lines_saved = 0
+
+    if cache is not None:
+        counters['cache hits'] = cache.hits
+        counters['cache misses'] = cache.misses
+        counters['cache evictions'] = cache.evictions
+        cache.hits = cache.misses = cache.evictions = 0
+
+    evidence = finder.evidence
+    if evidence is not None:
+        evidence = list(evidence)
+
+    return item + (counters, evidence)
+
+
+def iterate_results(filenames, default_tab_width, default_result,
+                    jobs=1, ordered=True, cache=None, early_exit=False,
+                    counters=None, use_numpy=False, with_evidence=False,
+                    with_counters=False, profile=False):
+    """Yield (filename, result_data, error_message) for each file.
+
+    error_message is None unless the file could not be read. With more than
+    one job, files are analysed in a pool of worker processes. Results then
+    come back in the order of filenames, or in completion order if ordered is
+    false.
+
+    If cache is a ResultCache, its database is used by every worker and its
+    hits, misses and evictions are updated with theirs. early_exit is passed
+    to parse_file(). If counters is a dictionary, the counters of the workers,
+    like 'lines saved', are added to it.
+
+    With use_numpy, if NumPy is installed, files are analysed in batches with
+    NumPy in this process instead. This cannot be combined with cache or
+    early_exit.
+
+    With with_evidence, the finder.evidence of each file, or None, is yielded
+    as a fourth item, as expected by aggregate_results(). This cannot be
+    combined with cache or use_numpy. With with_counters, files are also
+    measured and what each file added to the counters is yielded as the last
+    item. This cannot be combined with use_numpy.
+
+    With profile, files are analysed by a ProfilingIndentFinder and its
+    counters, like 'read seconds', are added to counters. This cannot be
+    combined with use_numpy either.
+
+    """
+    if use_numpy and (cache is not None or early_exit):
+        raise ValueError('use_numpy cannot be combined with cache or '
+                         'early_exit')
+
+    if with_evidence and (cache is not None or use_numpy):
+        raise ValueError('with_evidence cannot be combined with cache or '
+                         'use_numpy')
+
+    if (with_counters or profile) and use_numpy:
+        raise ValueError('with_counters and profile cannot be combined with '
+                         'use_numpy')
+
+    def collect(item):
+        return _collect_counters(item, cache=cache, counters=counters,
+                                 with_evidence=with_evidence,
+                                 with_counters=with_counters)
+
+    if use_numpy and _import_numpy():
+        for item in _iterate_numpy_items(filenames,
+                                         default_tab_width=default_tab_width,
+                                         default_result=default_result):
+            yield item[:3]
+        return
+
+    if cache is None:
+        worker_arguments = (early_exit, None, None, with_counters, profile)
+    else:
+        worker_arguments = (early_exit, cache.path, cache.max_size,
+                            with_counters, profile)
+
+    if isinstance(filenames, (list, tuple)):
+        count = len(filenames)
+    else:
+        # An iterator, possibly from walk_files(), is consumed lazily.
+        count = None
+
+    if jobs == 1 or count is not None and count < 2:
+        _initialize_worker(default_tab_width, default_result,
+                           *worker_arguments)
+        for filename in filenames:
+            yield collect(_parse_file_in_worker(filename))
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(
+        processes=jobs or None,
+        initializer=_initialize_worker,
+        initargs=(default_tab_width, default_result) + worker_arguments)
+    try:
+        # Send files in chunks so that inter-process communication does not
+        # dominate on small files, while still keeping every worker busy.
+        if count is None:
+            chunk_size = MAX_CHUNK_SIZE // 4
+        else:
+            chunk_size = max(
+                1,
+                min(MAX_CHUNK_SIZE,
+                    count // (4 * (jobs or multiprocessing.cpu_count()))))
+
+        if ordered:
+            mapper = pool.imap
+        else:
+            mapper = pool.imap_unordered
+
+        for item in mapper(_parse_file_in_worker, filenames, chunk_size):
+            yield collect(item)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _collect_counters(item, cache, counters, with_evidence=False,
+                      with_counters=False):
+    """Add counters of a worker item to cache and counters.
+
+    Return (filename, result_data, error_message), followed by the evidence
+    and the counters of the item if requested.
+
+    """
+    item_counters = item[3]
+
+    if cache is not None:
+        cache.hits += item_counters['cache hits']
+        cache.misses += item_counters['cache misses']
+        cache.evictions += item_counters['cache evictions']
+
+    if counters is not None:
+        for (name, value) in item_counters.items():
+            counters[name] = counters.get(name, 0) + value
+
+    selected = item[:3]
+    if with_evidence:
+        selected += (item[4],)
+    if with_counters:
+        selected += (item_counters,)
+    return selected
+
+
+# Extensions whose files are aggregated with those of another extension.
+AGGREGATED_EXTENSIONS = {
+    '.C': '.cc',
+    '.cpp': '.cc',
+    '.cxx': '.cc',
+    '.h': '.c',
+    '.hh': '.cc',
+    '.hpp': '.cc',
+}
+
+
+def aggregate_results(items, default_tab_width, default_result, ordered=True,
+                      min_confidence=MIN_CONFIDENCE):
+    """Yield each item with its result_data replaced if needed.
+
+    items are as yielded by iterate_results() with with_evidence. The evidence
+    of each file is added, as it comes, to the counts of its directory and
+    language. Files whose result has a confidence() below min_confidence get
+    the result of these counts instead of their own, which may be the default,
+    come from a handful of lines or be a close call.
+
+    With ordered, items are yielded in the same order, each directory once
+    all of its files were seen, since walk_files() yields them together.
+    Otherwise, the other files are yielded right away and those with
+    uncertain results at the end. Files are never read again; only the counts
+    of each directory and language and the pending items are kept.
+
+    The evidence of files that get the result of their directory and language
+    is replaced by its counts.
+
+    """
+    groups = {}
+    pending = []
+    directory = None
+
+    def is_uncertain(evidence):
+        return (evidence is not None and
+                _confidence_from_counts(evidence) < min_confidence)
+
+    def resolve(item):
+        (filename, _, error_message, evidence) = item[:4]
+        if not is_uncertain(evidence):
+            return item
+
+        # The result is decided from the counts of the group, which are
+        # therefore the evidence of the file.
+        counts = groups[_aggregate_key(filename)]
+        return (filename,
+                _results_from_counts(counts,
+                                     default_tab_width=default_tab_width,
+                                     default_result=default_result),
+                error_message,
+                list(counts)) + item[4:]
+
+    for item in items:
+        (filename, _, _, evidence) = item[:4]
+
+        if ordered and os.path.dirname(filename) != directory:
+            for pending_item in pending:
+                yield resolve(pending_item)
+            del pending[:]
+            directory = os.path.dirname(filename)
+
+        if evidence is not None:
+            counts = groups.setdefault(_aggregate_key(filename),
+                                       [0] * len(COUNT_KEYS))
+            for (index, count) in enumerate(evidence):
+                counts[index] += count
+
+        if ordered or is_uncertain(evidence):
+            pending.append(item)
+        else:
+            yield item
+
+    for pending_item in pending:
+        yield resolve(pending_item)
+
+
+def _aggregate_key(filename):
+    """Return key of the files whose evidence is shared with filename."""
+    (directory, name) = os.path.split(filename)
+    extension = os.path.splitext(name)[1]
+    return (directory, AGGREGATED_EXTENSIONS.get(extension, extension))
+
+
+# Number of bytes analysed at once by the NumPy engine.
+NUMPY_BATCH_BYTES = 1 << 23
+
+
+def _import_numpy():
+    """Return the numpy module, or None if it is not installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _iterate_numpy_items(filenames, default_tab_width, default_result):
+    """Yield worker items like _parse_file_in_worker() using NumPy.
+
+    Files are read into batches of about NUMPY_BATCH_BYTES bytes, each of
+    which is analysed with array operations instead of a loop over lines.
+    Files that need decoding are analysed in Python.
+
+    """
+    numpy = _import_numpy()
+    finder = IndentFinder()
+
+    batch = []
+    batch_size = 0
+    for filename in filenames:
+        try:
+            result_data = _preset_result(filename,
+                                         default_tab_width=default_tab_width,
+                                         default_result=default_result)
+            if result_data is None:
+                data = read_bytes(filename, MAX_BYTES,
+                                  windows=SAMPLE_WINDOWS)
+                if _contains_any(data, UNICODE_LINE_BOUNDARIES):
+                    result_data = _parse_lines(
+                        finder, filename, decode_lines(data),
+                        default_tab_width=default_tab_width,
+                        default_result=default_result)
+        except (IOError, OSError):
+            batch.append((filename, None, '%s' % (sys.exc_info()[1],)))
+            continue
+
+        if result_data is None:
+            batch.append((filename, data, None))
+            batch_size += len(data) + 1
+        else:
+            batch.append((filename, result_data, None))
+
+        if batch_size >= NUMPY_BATCH_BYTES:
+            for item in _parse_numpy_batch(numpy, batch,
+                                           default_tab_width=default_tab_width,
+                                           default_result=default_result):
+                yield item
+            batch = []
+            batch_size = 0
+
+    for item in _parse_numpy_batch(numpy, batch,
+                                   default_tab_width=default_tab_width,
+                                   default_result=default_result):
+        yield item
+
+
+def _parse_numpy_batch(numpy, batch, default_tab_width, default_result):
+    """Yield worker items for batch.
+
+    batch holds (filename, data_or_result, error_message) where data is the
+    bytes to analyse, or where the result or error is already known.
+
+    """
+    datas = [(index, data) for (index, (_, data, error_message))
+             in enumerate(batch)
+             if error_message is None and isinstance(data, bytes)]
+
+    counts = {}
+    endings = {}
+    if datas:
+        (histograms, found_endings) = _count_steps_with_numpy(
+            numpy,
+            [data for (_, data) in datas],
+            [_required_ending(batch[index][0]) for (index, _) in datas])
+        for (position, (index, _)) in enumerate(datas):
+            counts[index] = histograms[position]
+            endings[index] = found_endings[position]
+
+    for (index, (filename, data, error_message)) in enumerate(batch):
+        if index in counts:
+            if endings[index]:
+                result_data = _results_from_counts(
+                    counts[index],
+                    default_tab_width=default_tab_width,
+                    default_result=default_result)
+            else:
+                result_data = default_result
+            yield (filename, result_data, None, {})
+        else:
+            yield (filename, data, error_message, {})
+
+
+def _count_steps_with_numpy(numpy, datas, required_endings):
+    """Return counts and whether the required ending was found, per data.
+
+    This is the array equivalent of analysing each line of each data, as
+    split by bytes.splitlines(), with IndentFinder.analyse_bytes_line().
+    Required endings may be None. Apart from finding line ends, only the bytes
+    around the start and the end of each line are looked at.
+
+    """
+    # Terminate each data so that lines never span two of them.
+    joined = b''.join([data + b'\n' for data in datas])
+    buffer = numpy.frombuffer(joined, dtype=numpy.uint8)
+    data_starts = numpy.cumsum([0] + [len(data) + 1 for data in datas[:-1]])
+
+    if b'\r' in joined:
+        # Lines end at '\r', '\n' or at the '\r' of '\r\n'.
+        is_return = buffer == ord('\r')
+        ends = numpy.flatnonzero(is_return | (buffer == ord('\n')))
+        ends = ends[~((buffer[ends] == ord('\n')) &
+                      is_return[numpy.maximum(ends - 1, 0)] & (ends > 0))]
+        next_starts = ends + 1 + (
+            is_return[ends] &
+            (buffer[numpy.minimum(ends + 1, len(buffer) - 1)] == ord('\n')))
+    else:
+        ends = numpy.flatnonzero(buffer == ord('\n'))
+        next_starts = ends + 1
+    starts = numpy.concatenate(([0], next_starts[:-1]))
+    owners = numpy.searchsorted(data_starts, starts, side='right') - 1
+
+    def skip(positions, characters, step=1, limits=None):
+        """Move positions by step while they are on one of characters."""
+        table = numpy.zeros(256, dtype=bool)
+        table[bytearray(characters)] = True
+        positions = positions.copy()
+        active = numpy.flatnonzero(table[buffer[positions]])
+        while len(active):
+            positions[active] += step
+            if limits is not None:
+                active = active[positions[active] != limits[active]]
+            active = active[table[buffer[positions[active]]]]
+        return positions
+
+    # Line ends are neither spaces nor tabs, so these stop on every line.
+    tab_ends = skip(starts, b'\t')
+    space_ends = skip(tab_ends, b' ')
+    texts = skip(space_ends, b' \t')
+
+    widths = texts - starts
+    tabs = tab_ends - starts
+    spaces = widths - tabs
+    first = buffer[texts]
+    second = buffer[numpy.minimum(texts + 1, len(buffer) - 1)]
+
+    codes = numpy.full(len(starts), -1, dtype=numpy.int8)
+    has_text = texts < ends
+    codes[has_text & (widths == 0)] = LineCode.no_indent
+
+    # Lines with a tab after a space have no valid code.
+    indented = (
+        has_text & (widths > 0) & (space_ends == texts) &
+        (first != ord('*')) & (first != ord('#')) &
+        ~((first == ord('/')) & (second == ord('*')) & (texts + 1 < ends)))
+    codes[indented & (tabs == 0) & (widths < MAX_SPACES)] = (
+        LineCode.begin_space)
+    codes[indented & (tabs == 0) & (widths >= MAX_SPACES)] = (
+        LineCode.space_only)
+    codes[indented & (tabs > 0) & (spaces == 0)] = LineCode.tab_only
+    codes[indented & (tabs > 0) & (spaces > 0) &
+          (spaces < MAX_SPACES)] = LineCode.mixed
+
+    # A line is skipped if the previous line of the same data ends with a
+    # backslash. Skipped lines are not part of any step.
+    continued = (ends > starts) & (buffer[numpy.maximum(ends - 1, 0)] ==
+                                   ord('\\'))
+    skipped = numpy.zeros(len(starts), dtype=bool)
+    skipped[1:] = continued[:-1] & (owners[1:] == owners[:-1])
+    kept = numpy.flatnonzero(~skipped)
+
+    current = kept[1:]
+    previous = kept[:-1]
+    same = (owners[current] == owners[previous])
+    current = current[same]
+    previous = previous[same]
+
+    code = codes[current]
+    previous_code = codes[previous]
+    difference_tabs = tabs[current] - tabs[previous]
+    difference_spaces = spaces[current] - spaces[previous]
+    mixed_step = MAX_SPACES - spaces[previous]
+
+    def in_range(nb_space):
+        return (nb_space >= MIN_SPACES) & (nb_space <= MAX_SPACES)
+
+    rules = [
+        # (condition, index of the count to increment)
+        (((code == LineCode.tab_only) &
+          ((previous_code == LineCode.tab_only) |
+           (previous_code == LineCode.no_indent)) &
+          (difference_tabs == 1)),
+         numpy.full(len(code), TAB_INDEX)),
+        (((code == LineCode.tab_only) &
+          (previous_code == LineCode.begin_space) &
+          (tabs[current] == 1) & in_range(mixed_step)),
+         MIXED_OFFSET + mixed_step),
+        (((code == LineCode.tab_only) &
+          (previous_code == LineCode.mixed) &
+          (difference_tabs == 1) & in_range(mixed_step)),
+         MIXED_OFFSET + mixed_step),
+        (((code == LineCode.space_only) &
+          ((previous_code == LineCode.space_only) |
+           (previous_code == LineCode.begin_space) |
+           (previous_code == LineCode.no_indent)) &
+          in_range(difference_spaces)),
+         SPACE_OFFSET + difference_spaces),
+        (((code == LineCode.begin_space) &
+          ((previous_code == LineCode.begin_space) |
+           (previous_code == LineCode.no_indent)) &
+          in_range(difference_spaces)),
+         SPACE_OFFSET + difference_spaces),
+        (((code == LineCode.begin_space) &
+          ((previous_code == LineCode.begin_space) |
+           (previous_code == LineCode.no_indent)) &
+          in_range(difference_spaces)),
+         MIXED_OFFSET + difference_spaces),
+        (((code == LineCode.mixed) &
+          (previous_code == LineCode.tab_only) &
+          (difference_tabs == 0) & in_range(spaces[current])),
+         MIXED_OFFSET + spaces[current]),
+    ]
+
+    size = len(COUNT_KEYS)
+    histograms = numpy.zeros(len(datas) * size, dtype=numpy.int64)
+    for (condition, indices) in rules:
+        histograms += numpy.bincount(
+            owners[current[condition]] * size + indices[condition],
+            minlength=len(histograms))
+    histograms = histograms.reshape(len(datas), size).tolist()
+
+    ending_codes = numpy.array(
+        [-1 if ending is None else ord(ending) for ending in required_endings])
+    found_endings = ending_codes < 0
+    if not numpy.all(found_endings):
+        # Find the last byte that bytes.rstrip(ASCII_WHITESPACE) keeps, on
+        # lines of data that need an ending.
+        lines = numpy.flatnonzero(~found_endings[owners] & (ends > starts))
+        lasts = skip(ends[lines] - 1, ASCII_WHITESPACE,
+                     step=-1, limits=starts[lines] - 1)
+        has_last = lasts >= starts[lines]
+        lines = lines[has_last]
+        lasts = lasts[has_last]
+        last_bytes = buffer[lasts]
+
+        matches = last_bytes == ending_codes[owners[lines]]
+        found_endings |= numpy.bincount(owners[lines[matches]],
+                                        minlength=len(datas)) > 0
+
+        # There may be some Unicode whitespace to strip.
+        for line in lines[last_bytes >= 0x80]:
+            index = owners[line]
+            if not found_endings[index] and _line_ends_with(
+                    datas[index][starts[line] - data_starts[index]:
+                                 ends[line] - data_starts[index]].decode(
+                                     'utf-8', 'replace'),
+                    required_endings[index]):
+                found_endings[index] = True
+
+    return (histograms, found_endings.tolist())
+
+
+class _Options(object):
+
+    """Default values of the command-line options."""
+
+    vim_output = None
+    vim_batch = None
+    default_tab_width = 8
+    default_spaces = 4
+    default_to_tabs = None
+    confidence = None
+    server = None
+    jobs = 1
+    concurrent_reads = 0
+    unordered = None
+    early_exit = None
+    numpy = None
+    aggregate = None
+    json = None
+    profile = None
+    cprofile = None
+    stdin_filename = None
+    revision = None
+    cache = None
+    cache_file = None
+    cache_size = DEFAULT_CACHE_SIZE
+    cache_stats = None
+
+    def __init__(self):
+        self.exclude = []
+        self.extensions = []
+
+
+def _parse_simple_arguments(arguments):
+    """Return (options, args) without optparse, or None if it is needed.
+
+    Only filenames and the options that the vim plugin passes are understood,
+    which saves importing optparse on every buffer read.
+
+    """
+    options = _Options()
+    args = []
+    for argument in arguments:
+        if not argument.startswith('-'):
+            args.append(argument)
+        elif argument == '--vim-output':
+            options.vim_output = True
+        elif argument == '--vim-batch':
+            options.vim_batch = True
+        elif argument == '--default-to-tabs':
+            options.default_to_tabs = True
+        elif argument.startswith('--stdin-filename='):
+            options.stdin_filename = argument.split('=', 1)[1]
+        elif argument.startswith(('--default-tab-width=',
+                                  '--default-spaces=')):
+            (name, value) = argument[2:].split('=', 1)
+            try:
+                setattr(options, name.replace('-', '_'), int(value))
+            except ValueError:
+                return None
+        else:
+            return None
+
+    if options.stdin_filename is not None and (args or options.vim_batch):
+        # Let the option parser report the error.
+        return None
+
+    return (options, args)
+
+
+def _parse_arguments(arguments):
+    """Return (options, args) parsed with optparse."""
+    import optparse
+
+    parser = optparse.OptionParser(
+        version='indent-finder %s' % (__version__,))
+
+    parser.add_option('--vim-output', action='store_true',
+                      help='output suitable to use inside vim')
+    parser.add_option('--vim-batch', action='store_true',
+                      help='print a line of JSON [filename, settings] per '
+                           'file, where settings are like --vim-output, so '
+                           'that vim can analyse many files at once')
+    parser.add_option('--default-tab-width', type=int,
+                      default=8,
+                      help='default tab width (%default)')
+    parser.add_option('--default-spaces', type=int,
+                      default=4,
+                      help='default indentation width (%default)')
+    parser.add_option('--default-to-tabs', action='store_true',
+                      help='default to tabs')
+    parser.add_option('--confidence', action='store_true',
+                      help='print how clearly each result was decided, from '
+                           '0 to 1, after it')
+    parser.add_option('--json', action='store_true',
+                      help='print a line of JSON per file as soon as it is '
+                           'analysed, with the counts of indentation steps, '
+                           'the lines and bytes examined and the time taken')
+    parser.add_option('--server', action='store_true',
+                      help='answer JSON requests on standard input until it '
+                           'is closed')
+    parser.add_option('--stdin-filename', metavar='FILENAME',
+                      help='analyse standard input, up to %d bytes, as if '
+                           'it were the content of FILENAME' % (MAX_BYTES,))
+    parser.add_option('--revision', metavar='REVISION',
+                      help='analyse the files tracked at REVISION in the git '
+                           'repository of the current directory, without '
+                           'checking them out; arguments restrict the paths')
+    parser.add_option('-j', '--jobs', type=int, default=1,
+                      help='number of files to analyse in parallel; 0 means '
+                           'one per CPU (%default)')
+    parser.add_option('--concurrent-reads', type=int, default=0,
+                      metavar='N',
+                      help='read up to N files at once with asyncio while '
+                           'analysing them in this process, which is faster '
+                           'on high-latency file systems like NFS; requires '
+                           'Python 3.6')
+    parser.add_option('--unordered', action='store_true',
+                      help='with --jobs or --concurrent-reads, print results '
+                           'as soon as they are ready rather than in the '
+                           'order of the arguments')
+    parser.add_option('--exclude', action='append', default=[],
+                      metavar='PATTERN',
+                      help='skip files matching this .gitignore-style '
+                           'pattern, relative to each directory walked; can '
+                           'be given more than once')
+    parser.add_option('--extension', action='append', default=[],
+                      dest='extensions', metavar='EXTENSION',
+                      help='only analyse files ending with this extension '
+                           'when walking directories; can be given more than '
+                           'once')
+    parser.add_option('--early-exit', action='store_true',
+                      help='stop analysing a file as soon as the rest of it '
+                           'cannot change the result, and print the number '
+                           'of lines that were skipped to standard error')
+    parser.add_option('--numpy', action='store_true',
+                      help='analyse files in batches with NumPy, which is '
+                           'faster on many files, if it is installed')
+    parser.add_option('--aggregate', action='store_true',
+                      help='give files with little indentation to go by, '
+                           'like short files or headers, the indentation '
+                           'of the other files of their directory and '
+                           'language')
+    parser.add_option('--profile', action='store_true',
+                      help='print to standard error how many lines of each '
+                           'type were analysed and how long reading, '
+                           'decoding, analysing and deciding took')
+    parser.add_option('--cprofile', action='store_true',
+                      help='like --profile but also run under cProfile and '
+                           'print the functions that took the most time; '
+                           'only this process is profiled')
+    parser.add_option('--cache', action='store_true',
+                      help='reuse results of unchanged files across '
+                           'invocations; the cache is stored in ' +
+                           default_cache_path().replace('%', '%%'))
+    parser.add_option('--cache-file', metavar='PATH',
+                      help='like --cache but store the cache in PATH')
+    parser.add_option('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                      help='maximum number of cached results (%default)')
+    parser.add_option('--cache-stats', action='store_true',
+                      help='print cache hits, misses and evictions to '
+                           'standard error')
+
+    (options, args) = parser.parse_args(arguments)
+
+    if options.stdin_filename is not None and args:
+        parser.error('--stdin-filename cannot be combined with files')
+
+    if options.revision is not None and (
+        options.stdin_filename is not None or options.jobs != 1 or
+        options.numpy
+    ):
+        parser.error('--revision cannot be combined with --stdin-filename, '
+                     '--jobs or --numpy')
+
+    if options.jobs < 0:
+        parser.error('--jobs must not be negative')
+
+    if options.cache_size < 1:
+        parser.error('--cache-size must be positive')
+
+    if options.concurrent_reads < 0:
+        parser.error('--concurrent-reads must not be negative')
+
+    if options.concurrent_reads and sys.version_info < (3, 6):
+        parser.error('--concurrent-reads requires Python 3.6')
+
+    if options.concurrent_reads and (
+        options.stdin_filename is not None or
+        options.revision is not None or options.jobs != 1 or
+        options.numpy or options.cache or options.cache_file or
+        options.cache_stats or options.json or options.profile
+    ):
+        parser.error('--concurrent-reads cannot be combined with '
+                     '--stdin-filename, --revision, --jobs, --numpy, --cache, '
+                     '--json or --profile')
+
+    if options.numpy and (
+        options.jobs != 1 or options.early_exit or options.cache or
+        options.cache_file or options.cache_stats
+    ):
+        parser.error('--numpy cannot be combined with --jobs, --early-exit '
+                     'or --cache')
+
+    if options.aggregate and (
+        options.stdin_filename is not None or
+        options.revision is not None or options.numpy or options.cache or
+        options.cache_file or options.cache_stats
+    ):
+        parser.error('--aggregate cannot be combined with --stdin-filename, '
+                     '--revision, --numpy or --cache')
+
+    if options.cprofile:
+        options.profile = True
+
+    if options.profile and (options.server or options.numpy):
+        parser.error('--profile cannot be combined with --server or --numpy')
+
+    if options.vim_batch and (
+        options.server or options.stdin_filename is not None or
+        options.json
+    ):
+        parser.error('--vim-batch cannot be combined with --server, '
+                     '--stdin-filename or --json')
+
+    if options.confidence and (
+        options.vim_output or options.vim_batch or options.json or
+        options.server or options.revision is not None or options.numpy or
+        options.cache or options.cache_file or options.cache_stats
+    ):
+        parser.error('--confidence cannot be combined with --vim-output, '
+                     '--vim-batch, --json, --server, --revision, --numpy or '
+                     '--cache')
+
+    if options.json and (
+        options.vim_output or options.server or
+        options.stdin_filename is not None or
+        options.revision is not None or options.numpy or options.cache or
+        options.cache_file or options.cache_stats
+    ):
+        parser.error('--json cannot be combined with --vim-output, --server, '
+                     '--stdin-filename, --revision, --numpy or --cache')
+
+    return (options, args)
+
+
+def vim_buffer_output(lines, filename, arguments=()):
+    """Return vim_output() of the lines of an editor buffer.
+
+    This is for editors that embed Python, like vim with +python3, so that
+    they do not have to run indent_finder.py for each buffer. lines may be a
+    vim buffer object, which is only read up to MAX_BYTES characters. filename
+    decides which rules apply and arguments are the command-line options of
+    the defaults, as the vim plugin passes them.
+
+    """
+    (options, _) = (_parse_simple_arguments(arguments) or
+                    _parse_arguments(arguments))
+
+    return vim_output(parse_lines(lines,
+                                  default_tab_width=options.default_tab_width,
+                                  default_result=_default_result(options),
+                                  filename=filename),
+                      default_tab_width=options.default_tab_width)
+
+
+def _default_result(options):
+    if options.default_to_tabs:
+        return (IndentType.tab, options.default_tab_width)
+    return (IndentType.space, options.default_spaces)
+
+
+def _write_profile(counters):
+    for name in PROFILE_COUNTERS:
+        if name.endswith(' seconds'):
+            value = '%.6f' % (counters.get(name, 0.),)
+        else:
+            value = '%d' % (counters.get(name, 0),)
+        sys.stderr.write('profile: %s %s\n' % (value, name))
+
+
+# Number of functions printed by --cprofile.
+CPROFILE_FUNCTIONS = 25
+
+
+def main():
+    arguments = sys.argv[1:]
+    (options, args) = (_parse_simple_arguments(arguments) or
+                       _parse_arguments(arguments))
+
+    if not options.cprofile:
+        return _run(options, args)
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(_run, options, args)
+    finally:
+        statistics = pstats.Stats(profiler, stream=sys.stderr)
+        statistics.sort_stats('cumulative').print_stats(CPROFILE_FUNCTIONS)
+
+
+def _run(options, args):
+    default_result = _default_result(options)
+
+    if options.server:
+        input_file = sys.stdin
+        if hasattr(input_file, 'buffer'):
+            import io
+
+            # Buffers sent by editors may not be valid UTF-8.
+            input_file = io.TextIOWrapper(input_file.buffer,
+                                          encoding='utf-8',
+                                          errors='replace')
+
+        serve(input_file, sys.stdout,
+              default_tab_width=options.default_tab_width,
+              default_result=default_result,
+              vim=options.vim_output)
+        return
+
+    if options.stdin_filename is not None:
+        if options.profile:
+            finder = ProfilingIndentFinder()
+        else:
+            finder = IndentFinder()
+
+        result_data = _parse_file(
+            finder,
+            filename=options.stdin_filename,
+            default_tab_width=options.default_tab_width,
+            default_result=default_result,
+            early_exit=options.early_exit,
+            input_file=getattr(sys.stdin, 'buffer', sys.stdin))
+
+        if options.confidence:
+            evidence = finder.evidence
+        else:
+            evidence = None
+
+        sys.stdout.write(format_output(
+            None, result_data,
+            vim=options.vim_output,
+            default_tab_width=options.default_tab_width,
+            evidence=evidence))
+
+        if options.profile:
+            _write_profile(finder.counters)
+        return
+
+    if options.cache_file:
+        cache = ResultCache(options.cache_file, max_size=options.cache_size)
+    elif options.cache or options.cache_stats:
+        cache = ResultCache(default_cache_path(), max_size=options.cache_size)
+    else:
+        cache = None
+
+    counters = {}
+
+    if options.revision is not None:
+        try:
+            results_iterator = iterate_git_results(
+                options.revision, args,
+                default_tab_width=options.default_tab_width,
+                default_result=default_result,
+                extensions=options.extensions,
+                cache=cache,
+                early_exit=options.early_exit)
+        except (IOError, OSError):
+            if cache is not None:
+                cache.close()
+            sys.stderr.write('%s\n' % (sys.exc_info()[1],))
+            return 1
+
+        multiple = True
+    else:
+        multiple = (len(args) > 1 or
+                    any(os.path.isdir(path) for path in args))
+
+        filenames = walk_files(
+            args,
+            ignore_rules=IgnoreRules().extended(None, options.exclude),
+            extensions=options.extensions)
+
+        if options.concurrent_reads:
+            import indent_finder_async
+
+            results_iterator = indent_finder_async.iterate_results(
+                filenames,
+                default_tab_width=options.default_tab_width,
+                default_result=default_result,
+                concurrency=options.concurrent_reads,
+                ordered=not options.unordered,
+                early_exit=options.early_exit,
+                counters=counters,
+                with_evidence=options.aggregate or options.confidence)
+        else:
+            results_iterator = iterate_results(
+                filenames,
+                default_tab_width=options.default_tab_width,
+                default_result=default_result,
+                jobs=options.jobs,
+                ordered=not options.unordered,
+                cache=cache,
+                early_exit=options.early_exit,
+                counters=counters,
+                use_numpy=options.numpy,
+                with_evidence=(options.aggregate or options.json or
+                               options.confidence),
+                with_counters=options.json,
+                profile=options.profile)
+
+        if options.aggregate:
+            results_iterator = aggregate_results(
+                results_iterator,
+                default_tab_width=options.default_tab_width,
+                default_result=default_result,
+                ordered=not options.unordered)
+    status = None
+    try:
+        for item in results_iterator:
+            (filename, result_data, error_message) = item[:3]
+
+            if options.vim_batch:
+                sys.stdout.write(vim_batch_output(
+                    filename, result_data,
+                    default_tab_width=options.default_tab_width))
+                continue
+
+            if options.json:
+                sys.stdout.write(json_output(filename, result_data,
+                                             error_message, *item[3:]))
+                # Let other tools follow long scans.
+                sys.stdout.flush()
+                if error_message is not None:
+                    status = 1
+                continue
+
+            if error_message is not None:
+                # Only print error message in non-Vim mode. Otherwise, we will
+                # be passing garbage to Vim.
+                if not options.vim_output:
+                    sys.stderr.write('%s\n' % (error_message,))
+
+                    return 1
+
+                continue
+
+            if multiple:
+                prefix = filename
+            else:
+                prefix = None
+
+            if options.confidence:
+                evidence = item[3]
+            else:
+                evidence = None
+
+            sys.stdout.write(format_output(
+                prefix, result_data,
+                vim=options.vim_output,
+                default_tab_width=options.default_tab_width,
+                evidence=evidence))
+    finally:
+        results_iterator.close()
+
+        if options.early_exit and not options.vim_output:
+            sys.stderr.write('early exit: %d lines saved\n' %
+                             (counters.get('lines saved', 0),))
+
+        if options.profile:
+            _write_profile(counters)
+
+        if cache is not None:
+            if options.cache_stats:
+                sys.stderr.write('cache: %d hits, %d misses, %d evictions\n' %
+                                 (cache.hits, cache.misses, cache.evictions))
+            cache.close()
 
-                return 1
+    return status
 
 
 if __name__ == '__main__':
@@ -1,26 +1,298 @@
-augroup IndentFinder
-    autocmd! IndentFinder
+let s:directory = fnamemodify(expand('<sfile>'), ':p:h')
+let s:script = s:directory . '/indent_finder.py'
+
+let s:default_tab_width_option = '--default-tab-width=' . &l:tabstop
+
+let s:default_to_tabs_option = ''
+if &l:expandtab == 0
+    let s:default_to_tabs_option = '--default-to-tabs'
+endif
+
+let s:default_spaces_option = '--default-spaces=' . &l:shiftwidth
+
+let s:options = filter(
+    \ [s:default_tab_width_option,
+    \  s:default_to_tabs_option,
+    \  s:default_spaces_option],
+    \ 'v:val != ""')
+
+" Skip site-packages and PYTHON* environment variables, which indent_finder.py
+" does not need, to start faster.
+function! s:Command()
+    return [get(g:, 'indent_finder_python', 'python3'), '-S', '-E', s:script]
+endfunction
+
+" Start the long-lived indent_finder.py process if it is not running yet.
+" Return 1 if it can be used.
+function! s:ServerReady()
+    if !get(g:, 'indent_finder_server', 1) || !has('job') || !has('channel')
+        return 0
+    endif
+
+    if exists('s:server') && job_status(s:server) ==# 'run'
+        return 1
+    endif
+
+    if exists('s:server_failed')
+        return 0
+    endif
+
+    let s:server = job_start(
+        \ s:Command() + ['--server', '--vim-output'] + s:options,
+        \ {'mode': 'json', 'err_io': 'null'})
+    if job_status(s:server) !=# 'run'
+        " Do not retry on every buffer.
+        let s:server_failed = 1
+        return 0
+    endif
+
+    return 1
+endfunction
+
+" Apply the settings found for buffer bufnr, unless it was closed or edited
+" since it was read. b:changedtick cannot tell since vim increments it after
+" BufRead.
+function! s:Apply(bufnr, result)
+    if !bufloaded(a:bufnr) || getbufvar(a:bufnr, '&modified')
+        return
+    endif
+
+    if a:bufnr != bufnr('%')
+        " The settings apply to the current buffer, so wait until it is.
+        execute 'autocmd IndentFinder BufEnter <buffer=' . a:bufnr . '> ' .
+            \ '++once call s:Apply(' . a:bufnr . ', ' . string(a:result) . ')'
+        return
+    endif
+
+    let b:indent_finder_result = a:result
+
+    execute b:indent_finder_result
+
+    if get(g:, 'indent_finder_debug', 0)
+        echo 'Indent Finder: ' . b:indent_finder_result
+    endif
+endfunction
+
+" Import indent_finder.py into vim's own Python if it has one. Return 1 if it
+" can be used. Neovim's Python runs in another process, so it would not be
+" faster than the server.
+function! s:InProcessReady()
+    if !get(g:, 'indent_finder_in_process', 1) || !has('python3') ||
+        \ has('nvim')
+        return 0
+    endif
+
+    if !exists('s:in_process')
+        try
+            execute 'py3 import sys; sys.path.insert(0, ' .
+                \ json_encode(s:directory) . ')'
+            py3 import indent_finder, vim
+            let s:in_process = 1
+        catch
+            let s:in_process = 0
+        endtry
+    endif
+
+    return s:in_process
+endfunction
 
-    let s:default_tab_width_option = '--default-tab-width=' . &l:tabstop
+" MAX_BYTES of indent_finder.py, which does not look further.
+let s:max_bytes = 100000
 
-    let s:default_to_tabs_option = ''
-    if &l:expandtab == 0
-        let s:default_to_tabs_option = '--default-to-tabs'
+" Return the number of the line of buffer bufnr that holds its s:max_bytes'th
+" byte, or of its last line. byte2line() would only look at the current buffer.
+function! s:LastLine(bufnr)
+    let l:bytes = 0
+    let l:last = 0
+    while l:bytes < s:max_bytes
+        " Do not copy all of a large buffer.
+        let l:lines = getbufline(a:bufnr, l:last + 1, l:last + 1000)
+        if empty(l:lines)
+            break
+        endif
+
+        for l:line in l:lines
+            let l:last += 1
+            let l:bytes += len(l:line) + 1
+            if l:bytes >= s:max_bytes
+                break
+            endif
+        endfor
+    endwhile
+    return max([l:last, 1])
+endfunction
+
+" Analyse buffer bufnr, which need not be the current one, as if it were the
+" content of filename and apply the result when it is ready. The buffer is
+" analysed by vim's own Python if possible, which takes well under a
+" millisecond. Otherwise, it is sent to indent_finder.py rather than read
+" again from the file. Unless jobs are not available, the analysis then runs
+" in the background so that vim does not wait for slow file systems.
+function! s:Detect(bufnr, filename)
+    let l:Callback = function('s:Apply', [a:bufnr])
+
+    if s:InProcessReady()
+        try
+            let l:result = py3eval(printf(
+                \ 'indent_finder.vim_buffer_output(vim.buffers[%d], %s, %s)',
+                \ a:bufnr, json_encode(a:filename), json_encode(s:options)))
+        catch
+            " Fall back to running indent_finder.py from now on.
+            let s:in_process = 0
+        endtry
+
+        if s:in_process
+            call l:Callback(l:result)
+            return
+        endif
     endif
+    let l:command = s:Command() + ['--vim-output'] + s:options +
+        \ ['--stdin-filename=' . a:filename]
+
+    let l:last = s:LastLine(a:bufnr)
+
+    if !get(g:, 'indent_finder_async', 1)
+        " Use system() below.
+    elseif has('nvim')
+        let l:job = jobstart(l:command, {
+            \ 'stdout_buffered': 1,
+            \ 'on_stdout': {job, data, event -> l:Callback(join(data, "\n"))}})
+        call chansend(l:job, getbufline(a:bufnr, 1, l:last) + [''])
+        call chanclose(l:job, 'stdin')
+        return
+    elseif s:ServerReady()
+        call ch_sendexpr(
+            \ job_getchannel(s:server),
+            \ {'filename': a:filename,
+            \  'lines': getbufline(a:bufnr, 1, l:last)},
+            \ {'callback': {channel, result -> l:Callback(result)}})
+        return
+    elseif has('job') && has('channel') && has('lambda')
+        let l:output = []
+        call job_start(l:command, {
+            \ 'in_io': 'buffer',
+            \ 'in_buf': a:bufnr,
+            \ 'in_bot': l:last,
+            \ 'err_io': 'null',
+            \ 'out_mode': 'raw',
+            \ 'out_cb': {channel, message -> add(l:output, message)},
+            \ 'close_cb': {channel -> l:Callback(join(l:output, ''))}})
+        return
+    endif
+
+    call l:Callback(system(
+        \ join(map(l:command, 'shellescape(v:val)'), ' '),
+        \ getbufline(a:bufnr, 1, l:last)))
+endfunction
 
-    let s:default_spaces_option = '--default-spaces=' . &l:shiftwidth
+" Settings of files analysed by s:DetectArguments(), keyed by full path, as
+" [settings, modification time of the file].
+let s:batch_results = {}
 
-    autocmd BufRead * let b:indent_finder_result = system(
-        \ fnamemodify(expand('<sfile>'), ':p:h') .
-        \ '/indent_finder.py --vim-output ' .
-        \ s:default_tab_width_option . ' ' .
-        \ s:default_to_tabs_option . ' ' .
-        \ s:default_spaces_option . ' ' .
-        \ shellescape(expand('%')))
+" Buffers read while the batch runs, as filenames keyed by buffer number.
+let s:pending = {}
 
-    autocmd BufRead * execute b:indent_finder_result
+" Return 1 if the files of the argument list are analysed at once on startup,
+" which is not needed when buffers are analysed by vim's own Python.
+function! s:BatchEnabled()
+    return get(g:, 'indent_finder_batch', 1) && exists('*json_decode') &&
+        \ !s:InProcessReady()
+endfunction
 
-    if exists('g:indent_finder_debug') && g:indent_finder_debug
-        autocmd BufRead * echo "Indent Finder: " . b:indent_finder_result
+function! s:Read(bufnr, filename)
+    let l:batch_result = get(s:batch_results, a:filename, [])
+    if !empty(l:batch_result)
+        call remove(s:batch_results, a:filename)
+        if l:batch_result[1] == getftime(a:filename)
+            call s:Apply(a:bufnr, l:batch_result[0])
+            return
+        endif
     endif
+
+    if exists('s:batch_running') ||
+        \ has('vim_starting') && argc() > 1 && s:BatchEnabled()
+        " Wait for s:DetectArguments().
+        let s:pending[a:bufnr] = a:filename
+        return
+    endif
+
+    call s:Detect(a:bufnr, a:filename)
+endfunction
+
+" Analyse the files of the argument list with a single run of
+" indent_finder.py rather than one per buffer, so that opening many files
+" does not start as many processes.
+function! s:DetectArguments()
+    if argc() < 2 && empty(s:pending)
+        return
+    endif
+
+    let l:filenames = values(s:pending)
+    for l:filename in map(argv(), 'fnamemodify(v:val, ":p")')
+        if filereadable(l:filename) && index(l:filenames, l:filename) < 0
+            call add(l:filenames, l:filename)
+        endif
+    endfor
+
+    if empty(l:filenames)
+        return
+    endif
+
+    let s:batch_running = 1
+    let l:command = s:Command() + ['--vim-batch'] + s:options + l:filenames
+
+    if !get(g:, 'indent_finder_async', 1)
+        " Use system() below.
+    elseif has('nvim')
+        call jobstart(l:command, {
+            \ 'stdout_buffered': 1,
+            \ 'on_stdout': {job, data, event ->
+            \                s:ApplyBatch(join(data, "\n"))}})
+        return
+    elseif has('job') && has('channel') && has('lambda')
+        let l:output = []
+        call job_start(l:command, {
+            \ 'in_io': 'null',
+            \ 'err_io': 'null',
+            \ 'out_mode': 'raw',
+            \ 'out_cb': {channel, message -> add(l:output, message)},
+            \ 'close_cb': {channel -> s:ApplyBatch(join(l:output, ''))}})
+        return
+    endif
+
+    call s:ApplyBatch(system(
+        \ join(map(l:command, 'shellescape(v:val)'), ' ')))
+endfunction
+
+" Apply the output of indent_finder.py --vim-batch to the buffers read
+" meanwhile and keep it for the other files.
+function! s:ApplyBatch(output)
+    for l:line in split(a:output, "\n")
+        try
+            let [l:filename, l:result] = json_decode(l:line)
+        catch
+            continue
+        endtry
+
+        if !empty(l:result)
+            let s:batch_results[l:filename] = [l:result, getftime(l:filename)]
+        endif
+    endfor
+
+    unlet! s:batch_running
+
+    let l:pending = s:pending
+    let s:pending = {}
+    for [l:bufnr, l:filename] in items(l:pending)
+        call s:Read(str2nr(l:bufnr), l:filename)
+    endfor
+endfunction
+
+augroup IndentFinder
+    autocmd! IndentFinder
+
+    autocmd BufRead * call s:Read(
+        \ str2nr(expand('<abuf>')), fnamemodify(expand('<afile>'), ':p'))
+
+    autocmd VimEnter * if s:BatchEnabled() | call s:DetectArguments() | endif
 augroup End
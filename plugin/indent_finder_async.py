@@ -0,0 +1,177 @@
+#
+# Indentation finder, by Philippe Fremy <phil at freehackers dot org>
+# Copyright (C) 2013-2018 Steven Myint
+#
+# This program is distributed under the BSD license. You should have received
+# a copy of the file LICENSE.txt along with this software.
+
+"""Analyses files read concurrently with asyncio.
+
+On file systems with a high latency, like NFS or FUSE mounts, reading files
+one after the other leaves the CPU idle most of the time. scan() keeps several
+reads in flight in a pool of threads and analyses the files as their content
+arrives, one at a time, with a single IndentFinder in the thread of the event
+loop.
+
+This is used by indent_finder.py --concurrent-reads. Unlike indent_finder.py,
+it requires Python 3.6 or later.
+
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import io
+import itertools
+
+import indent_finder
+
+
+DEFAULT_CONCURRENCY = 16
+
+
+def read_file(filename):
+    """Return the bytes of file that indent_finder.parse_file() analyses."""
+    return indent_finder.read_bytes(filename, indent_finder.MAX_BYTES,
+                                    windows=indent_finder.SAMPLE_WINDOWS)
+
+
+async def scan(filenames, default_tab_width, default_result,
+               concurrency=DEFAULT_CONCURRENCY, ordered=True,
+               early_exit=False, counters=None, with_evidence=False,
+               read=read_file, executor=None):
+    """Yield (filename, result_data, error_message) for each file.
+
+    Results are like those of indent_finder.iterate_results() but up to
+    concurrency files are read at once by read(), which is read_file() by
+    default, in executor. executor defaults to a ThreadPoolExecutor with
+    concurrency threads. Files whose name decides the result are not read.
+    Results come in the order of filenames, or in completion order if ordered
+    is false.
+
+    early_exit is passed to parse_file() and, if counters is a dictionary,
+    the lines it saved are added to its 'lines saved'. With with_evidence,
+    the finder.evidence of each file, or None, is yielded as a fourth item.
+
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be positive')
+
+    loop = asyncio.get_event_loop()
+
+    shutdown_executor = executor is None
+    if shutdown_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+
+    finder = indent_finder.IndentFinder()
+    filenames = iter(filenames)
+
+    # (filename, future) of the files being read, in the order of filenames.
+    # The future is None for files that do not need to be read.
+    pending = collections.deque()
+    try:
+        while True:
+            for filename in itertools.islice(filenames,
+                                             concurrency - len(pending)):
+                if indent_finder._preset_result(
+                        filename,
+                        default_tab_width=default_tab_width,
+                        default_result=default_result) is None:
+                    future = loop.run_in_executor(executor, read, filename)
+                else:
+                    future = None
+                pending.append((filename, future))
+
+            if not pending:
+                break
+
+            if ordered:
+                (filename, future) = pending.popleft()
+            else:
+                (filename, future) = await _pop_first_done(pending)
+
+            error_message = None
+            data = b''
+            if future is not None:
+                try:
+                    data = await future
+                except (IOError, OSError) as exception:
+                    error_message = '%s' % (exception,)
+
+            if error_message is None:
+                item = (filename,
+                        indent_finder._parse_file(
+                            finder,
+                            filename=filename,
+                            default_tab_width=default_tab_width,
+                            default_result=default_result,
+                            early_exit=early_exit,
+                            input_file=io.BytesIO(data)),
+                        None)
+            else:
+                item = (filename, None, error_message)
+                finder.evidence = None
+
+            if early_exit and counters is not None:
+                counters['lines saved'] = (counters.get('lines saved', 0) +
+                                           finder.lines_saved)
+
+            if with_evidence:
+                evidence = finder.evidence
+                if evidence is not None:
+                    evidence = list(evidence)
+                item += (evidence,)
+
+            yield item
+    finally:
+        for (_, future) in pending:
+            if future is not None:
+                future.cancel()
+
+        if shutdown_executor:
+            executor.shutdown(wait=False)
+
+
+async def _pop_first_done(pending):
+    """Remove and return the first entry of pending whose read is done."""
+    futures = [future for (_, future) in pending if future is not None]
+    if len(futures) == len(pending):
+        await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+
+    for (index, (_, future)) in enumerate(pending):
+        if future is None or future.done():
+            entry = pending[index]
+            del pending[index]
+            return entry
+
+
+def iterate_results(filenames, default_tab_width, default_result,
+                    concurrency=DEFAULT_CONCURRENCY, ordered=True,
+                    early_exit=False, counters=None, with_evidence=False,
+                    read=read_file):
+    """Yield the results of scan() from a new event loop.
+
+    This is for callers that do not run an event loop, like
+    indent_finder.iterate_results().
+
+    """
+    loop = asyncio.new_event_loop()
+    results = scan(filenames,
+                   default_tab_width=default_tab_width,
+                   default_result=default_result,
+                   concurrency=concurrency,
+                   ordered=ordered,
+                   early_exit=early_exit,
+                   counters=counters,
+                   with_evidence=with_evidence,
+                   read=read)
+    try:
+        while True:
+            try:
+                item = loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
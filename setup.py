@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# Indentation finder, by Philippe Fremy <phil at freehackers dot org>
+# Copyright (C) 2013-2018 Steven Myint
+#
+# This program is distributed under the BSD license. You should have received
+# a copy of the file LICENSE.txt along with this software.
+
+"""Setup for indent-finder.
+
+plugin/indent_finder.py is installed as the indent_finder module, with an
+indent-finder command. indent_finder_async, which requires Python 3.6 or
+later, is only installed there. The optional _indent_finder accelerator is
+built if a C compiler is available, and skipped otherwise. To build it next
+to the module for the vim plugin and the tests, run:
+
+    $ python setup.py build_ext --inplace
+
+"""
+
+import ast
+import io
+import sys
+
+from setuptools import Extension
+from setuptools import setup
+
+
+def version():
+    """Return version string."""
+    with io.open('plugin/indent_finder.py', encoding='utf-8') as input_file:
+        for line in input_file:
+            if line.startswith('__version__'):
+                return ast.literal_eval(line.split('=', 1)[1].strip())
+
+
+py_modules = ['indent_finder']
+if sys.version_info >= (3, 6):
+    py_modules.append('indent_finder_async')
+
+
+with io.open('README.rst', encoding='utf-8') as readme:
+    setup(name='indent-finder',
+          version=version(),
+          description='Detect the indentation of files.',
+          long_description=readme.read(),
+          license='BSD',
+          author='Steven Myint',
+          url='https://github.com/myint/indent-finder',
+          classifiers=['Environment :: Console',
+                       'License :: OSI Approved :: BSD License',
+                       'Programming Language :: Python :: 2',
+                       'Programming Language :: Python :: 3',
+                       'Topic :: Text Editors'],
+          package_dir={'': 'plugin'},
+          py_modules=py_modules,
+          ext_modules=[Extension('_indent_finder',
+                                 sources=['plugin/_indent_finder.c'],
+                                 optional=True)],
+          entry_points={'console_scripts': [
+              'indent-finder = indent_finder:main']})
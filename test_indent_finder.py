@@ -6,11 +6,21 @@
 # This program is distributed under the BSD license. You should have received
 # a copy of the file LICENSE.txt along with this software.
 
+import glob
+import itertools
 import os
+import random
+import shutil
 import subprocess
 import sys
+import tempfile
 import unittest
 
+# Import indent_finder from plugin/, where setup.py build_ext --inplace puts
+# its optional accelerator.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'plugin'))
+
 import indent_finder
 
 
@@ -90,6 +100,80 @@ class TestIndentFinder(unittest.TestCase):
         self.assertEqual(
             None, indent_finder.analyse_line_type('  \t\t' + 'coucou'))
 
+    def test_classify_line(self):
+        code = indent_finder.LineCode
+
+        # The pure Python classifiers, and the accelerated ones if any.
+        classifiers = [
+            (indent_finder._make_line_classifier(' \t*#/'), str),
+            (indent_finder._make_line_classifier(b' \t*#/', newline=b'\n'),
+             bytes),
+            (indent_finder.classify_line, str),
+            (indent_finder.classify_bytes_line, bytes)]
+
+        for (classify_line, line_type) in classifiers:
+            def classify(line):
+                if line_type is bytes:
+                    line = line.encode('ascii')
+                return classify_line(line)
+
+            self.assertEqual((code.no_indent, 0, 0), classify('coucou'))
+            self.assertEqual((code.begin_space, 0, 3), classify('   coucou'))
+            self.assertEqual((code.space_only, 0, 9),
+                             classify(' ' * 9 + 'coucou'))
+            self.assertEqual((code.tab_only, 2, 0), classify('\t\tcoucou'))
+            self.assertEqual((code.mixed, 2, 3), classify('\t\t   coucou'))
+            self.assertEqual((code.begin_space, 0, 1), classify(' /'))
+            self.assertEqual((code.tab_only, 70, 0),
+                             classify('\t' * 70 + 'coucou'))
+
+            for line in ['', ' ', '\t ', '\t\t' + ' ' * 8 + 'coucou',
+                         '\t \tcoucou', ' \tcoucou', '  # coucou',
+                         '  /* coucou', '   * coucou']:
+                self.assertEqual(None, classify(line))
+
+    @unittest.skipIf(indent_finder._accelerator is None,
+                     'the accelerator is not built or is disabled')
+    def test_accelerator(self):
+        python_classify_line = indent_finder._make_line_classifier(' \t*#/')
+        python_classify_bytes_line = indent_finder._make_line_classifier(
+            b' \t*#/', newline=b'\n')
+
+        lines = set()
+        generator = random.Random(0)
+        for _ in range(20000):
+            lines.add(''.join(generator.choice(' \t*#/x\n\u00e9')
+                              for _ in range(generator.randint(0, 12))))
+        lines.add('\t' * 70 + 'x')
+        lines.add('\t' * 70 + '   x')
+        lines.add(' ' * 70 + 'x')
+        for filename in glob.glob(os.path.join(ROOT_PATH, 'test_files',
+                                               '*', '*')):
+            with open(filename, 'rb') as input_file:
+                lines.update(line.decode('utf-8', 'replace')
+                             for line in input_file)
+
+        for line in sorted(lines):
+            self.assertEqual(python_classify_line(line),
+                             indent_finder.classify_line(line),
+                             repr(line))
+
+            line = line.encode('utf-8')
+            self.assertEqual(python_classify_bytes_line(line),
+                             indent_finder.classify_bytes_line(line),
+                             repr(line))
+
+        self.assertRaises(TypeError, indent_finder.classify_bytes_line, 'x')
+
+    def test_accelerator_constants(self):
+        try:
+            import _indent_finder
+        except ImportError:
+            self.skipTest('the accelerator is not built')
+
+        for (name, value) in indent_finder._accelerator_constants().items():
+            self.assertEqual(value, getattr(_indent_finder, name), name)
+
     def test_ignored_lines_patterns(self):
         self.assertEqual(indent_finder.analyse_line_type(''), None)
         self.assertEqual(indent_finder.analyse_line_type('  '), None)
@@ -248,6 +332,739 @@ class TestIndentFinder(unittest.TestCase):
         result = ifi.analyse_line('\t\t\t    hop')
         self.assertEqual(result, None)
 
+    def test_ignore_rules(self):
+        rules = indent_finder.IgnoreRules().extended(
+            'root',
+            ['# comment', '', '*.o', 'build/', '/top.c', 'docs/**/*.txt',
+             '!keep.o', '[!a].c', '[]x].h', '[.h'])
+
+        def is_ignored(path, is_directory=False):
+            return rules.is_ignored(os.path.join('root', path),
+                                    is_directory=is_directory)
+
+        self.assertTrue(is_ignored('a.o'))
+        self.assertTrue(is_ignored('sub/a.o'))
+        self.assertFalse(is_ignored('keep.o'))
+        self.assertFalse(is_ignored('a.c'))
+
+        self.assertTrue(is_ignored('build', is_directory=True))
+        self.assertTrue(is_ignored('sub/build', is_directory=True))
+        self.assertFalse(is_ignored('build'))
+
+        self.assertTrue(is_ignored('top.c'))
+        self.assertFalse(is_ignored('sub/top.c'))
+
+        self.assertTrue(is_ignored('docs/a.txt'))
+        self.assertTrue(is_ignored('docs/a/b/c.txt'))
+        self.assertFalse(is_ignored('a.txt'))
+
+        self.assertTrue(is_ignored('b.c'))
+        self.assertTrue(is_ignored('!.c'))
+        self.assertFalse(is_ignored('a.c'))
+        self.assertTrue(is_ignored('].h'))
+        self.assertTrue(is_ignored('x.h'))
+        self.assertFalse(is_ignored('y.h'))
+        self.assertTrue(is_ignored('[.h'))
+
+        self.assertFalse(rules.is_ignored('elsewhere/a.o', is_directory=False))
+
+    def test_walk_files(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ['a.c', 'b.h', 'b.o', 'notes.txt',
+                         os.path.join('.git', 'config'),
+                         os.path.join('sub', 'c.c'),
+                         os.path.join('sub', 'skipped.c'),
+                         os.path.join('build', 'd.c')]:
+                path = os.path.join(root, path)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'w').close()
+
+            with open(os.path.join(root, '.gitignore'), 'w') as output:
+                output.write('*.o\n')
+            with open(os.path.join(root, 'sub', '.gitignore'), 'w') as output:
+                output.write('skipped.c\n')
+
+            self.assertEqual(
+                [os.path.join(root, path) for path in
+                 ['a.c', 'b.h', os.path.join('sub', 'c.c')]],
+                list(indent_finder.walk_files(
+                    [root],
+                    ignore_rules=indent_finder.IgnoreRules().extended(
+                        root, ['build/']),
+                    extensions=['.c', '.h'])))
+
+            self.assertEqual(
+                ['explicit.o', os.path.join(root, 'notes.txt')],
+                list(indent_finder.walk_files(
+                    ['explicit.o', root],
+                    extensions=['.txt'])))
+        finally:
+            shutil.rmtree(root)
+
+    def test_aggregate_results(self):
+        root = tempfile.mkdtemp()
+        try:
+            files = {
+                'a.py': ''.join('  ' * i + 'if x:\n' for i in range(8)),
+                'b.py': 'if x:\n    y\n',
+                'c.h': 'int f();\n',
+                'd.c': 'int f()\n{\n' +
+                       ''.join('\t' * i + 'if (x) {\n' for i in range(1, 8)),
+                os.path.join('sub', 'e.py'): 'if x:\n    y\n',
+            }
+            os.mkdir(os.path.join(root, 'sub'))
+            for (name, content) in files.items():
+                with open(os.path.join(root, name), 'w') as output:
+                    output.write(content)
+
+            filenames = [os.path.join(root, name) for name in sorted(files)]
+
+            def results(ordered=True, jobs=1):
+                return indent_finder.aggregate_results(
+                    indent_finder.iterate_results(
+                        filenames + [os.path.join(root, 'missing.py')],
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT,
+                        jobs=jobs,
+                        ordered=ordered,
+                        with_evidence=True),
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT,
+                    ordered=ordered)
+
+            expected = [('space', 2), ('space', 2), ('tab', 8), ('tab', 8),
+                        ('space', 4), None]
+            self.assertEqual(
+                expected,
+                [item[1] for item in results()])
+
+            self.assertEqual(
+                sorted(zip(filenames + [os.path.join(root, 'missing.py')],
+                           expected)),
+                sorted(item[:2] for item in results(ordered=False, jobs=2)))
+
+            # A stray tab step does not make a clear result give way to the
+            # evidence of its siblings.
+            os.mkdir(os.path.join(root, 'clear'))
+            filenames = [os.path.join(root, 'clear', name)
+                         for name in ['a.txt', 'b.txt']]
+            with open(filenames[0], 'w') as output:
+                output.write('x\n  x\n' * 80 + 'x\n\tx\n')
+            with open(filenames[1], 'w') as output:
+                output.write('x\n\tx\n' * 200)
+
+            self.assertEqual(
+                [('space', 2), ('tab', 8)],
+                [item[1] for item in indent_finder.aggregate_results(
+                    indent_finder.iterate_results(
+                        filenames,
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT,
+                        with_evidence=True),
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT)])
+        finally:
+            shutil.rmtree(root)
+
+    def test_result_cache(self):
+        root = tempfile.mkdtemp()
+        try:
+            cache = indent_finder.ResultCache(
+                os.path.join(root, 'cache', 'results.sqlite3'),
+                max_size=2)
+
+            def parse(filename):
+                return cache.parse_file(
+                    indent_finder.IndentFinder(),
+                    os.path.join(root, filename),
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT)
+
+            def counts():
+                return (cache.hits, cache.misses, cache.evictions)
+
+            with open(os.path.join(root, 'a.c'), 'w') as output:
+                output.write('int main()\n{\n  return 0;\n}\n')
+            with open(os.path.join(root, 'b.c'), 'w') as output:
+                output.write('{\n\tb;\n')
+
+            self.assertEqual(('space', 2), parse('a.c'))
+            self.assertEqual((0, 1, 0), counts())
+            self.assertEqual(('space', 2), parse('a.c'))
+            self.assertEqual((1, 1, 0), counts())
+
+            # Same content but different modification time.
+            os.utime(os.path.join(root, 'a.c'), (0, 0))
+            self.assertEqual(('space', 2), parse('a.c'))
+            self.assertEqual((2, 1, 0), counts())
+
+            with open(os.path.join(root, 'a.c'), 'w') as output:
+                output.write('{\n\ta;\n')
+            self.assertEqual(('tab', 8), parse('a.c'))
+            self.assertEqual((2, 2, 0), counts())
+
+            # Results survive across instances.
+            cache.close()
+            cache = indent_finder.ResultCache(cache.path, max_size=1)
+            self.assertEqual(('tab', 8), parse('a.c'))
+            self.assertEqual((1, 0, 0), counts())
+
+            self.assertEqual(('tab', 8), parse('b.c'))
+            self.assertEqual((1, 1, 1), counts())
+
+            # Least recently used entry was evicted.
+            self.assertEqual(('tab', 8), parse('b.c'))
+            self.assertEqual(('tab', 8), parse('a.c'))
+            self.assertEqual((2, 2, 2), counts())
+
+            # Confident results are shared by all default results.
+            with open(os.path.join(root, 'c.c'), 'w') as output:
+                output.write('{\n' + '\tc;\n{\n' * 10)
+            self.assertEqual(('tab', 8), parse('c.c'))
+            for default_result in [('space', 2), ('tab', 8)]:
+                self.assertEqual(
+                    ('tab', 8),
+                    cache.parse_file(indent_finder.IndentFinder(),
+                                     os.path.join(root, 'c.c'),
+                                     default_tab_width=8,
+                                     default_result=default_result))
+            self.assertEqual(
+                ('tab', 4),
+                cache.parse_file(indent_finder.IndentFinder(),
+                                 os.path.join(root, 'c.c'),
+                                 default_tab_width=4,
+                                 default_result=TEST_DEFAULT_RESULT))
+            self.assertEqual((4, 4, 4), counts())
+            cache.close()
+        finally:
+            shutil.rmtree(root)
+
+    def test_git_results(self):
+        root = tempfile.mkdtemp()
+        try:
+            def git(*arguments):
+                subprocess.check_call(
+                    ['git', '-c', 'user.name=test', '-c', 'user.email=test',
+                     '-c', 'commit.gpgsign=false'] + list(arguments),
+                    cwd=root,
+                    stdout=subprocess.PIPE)
+
+            def commit(files):
+                for (name, content) in files.items():
+                    with open(os.path.join(root, name), 'w') as output:
+                        output.write(content)
+                git('add', '.')
+                git('commit', '-q', '-m', 'commit')
+
+            try:
+                git('init', '-q')
+            except OSError:
+                self.skipTest('git is not installed')
+
+            commit({'a.c': 'int main()\n{\n  return 0;\n}\n',
+                    'b.py': 'if x:\n\ty\n',
+                    'Makefile': 'all:\n    true\n'})
+            os.symlink('a.c', os.path.join(root, 'link.c'))
+            commit({'b.py': 'if x:\n   y\n'})
+
+            # The working tree does not matter.
+            with open(os.path.join(root, 'a.c'), 'w') as output:
+                output.write('{\n\tx;\n')
+
+            cache = indent_finder.ResultCache(
+                os.path.join(root, 'cache.sqlite3'))
+
+            def results(revision, paths=(), extensions=None):
+                return list(indent_finder.iterate_git_results(
+                    revision, paths,
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT,
+                    repository=root,
+                    extensions=extensions,
+                    cache=cache))
+
+            self.assertEqual(
+                [('Makefile', ('tab', 8), None),
+                 ('a.c', ('space', 2), None),
+                 ('b.py', ('tab', 8), None)],
+                results('HEAD~1'))
+            self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+            # Only the changed blob is analysed.
+            self.assertEqual(
+                [('Makefile', ('tab', 8), None),
+                 ('a.c', ('space', 2), None),
+                 ('b.py', ('space', 3), None)],
+                results('HEAD'))
+            self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+            self.assertEqual([('b.py', ('space', 3), None)],
+                             results('HEAD', extensions=['.py']))
+            self.assertEqual([('a.c', ('space', 2), None)],
+                             results('HEAD', paths=['a.c']))
+            cache.close()
+
+            self.assertRaises(IOError, results, 'missing_revision')
+        finally:
+            shutil.rmtree(root)
+
+    def test_read_lines(self):
+        contents = [
+            b'',
+            b'int f()\n{\n    a;\n        b;\n}\n',
+            b'int f()\r\n{\r\n  a;\r\n    b;\r\n}\r\n',
+            b'int f()\r{\r\ta;\r\t\tb;\r}',
+            b'x {\n\ta;\x0c\n\t\tb;\n\x0c\n\t\t\tc;\n',
+            b'x {\xc2\xa0\n  a;\xc2\x85  b;\xe2\x80\xa8    c;\n',
+            b'x\xff\xfe {\n\ta \\\n\t\t\tb;\n\t\tc;\n\xe9\n\t\td;\n',
+            b'{\n  \n   \t\n  a;\n    /* b */\n    # c\n    * d\n',
+        ]
+
+        root = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(root, 'test.c')
+            for content in contents:
+                with open(filename, 'wb') as output:
+                    output.write(content)
+
+                for (size, windows) in itertools.product(
+                        [3, 17, 40, indent_finder.MAX_BYTES], [1, 2, 3]):
+                    expected_finder = indent_finder.IndentFinder()
+                    expected = indent_finder._parse_lines(
+                        expected_finder, filename,
+                        indent_finder.forcefully_read_lines(filename, size,
+                                                            windows=windows),
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT)
+
+                    finder = indent_finder.IndentFinder()
+                    self.assertEqual(
+                        expected,
+                        indent_finder._parse_lines(
+                            finder, filename,
+                            indent_finder.read_lines(filename, size,
+                                                     windows=windows),
+                            default_tab_width=8,
+                            default_result=TEST_DEFAULT_RESULT),
+                        (content, size, windows))
+                    self.assertEqual(expected_finder.lines, finder.lines,
+                                     (content, size, windows))
+        finally:
+            shutil.rmtree(root)
+
+    def test_read_sampled_bytes(self):
+        lines = [('    ' * (i % 3) + 'x%d;\n' % i).encode()
+                 for i in range(1000)]
+        content = b''.join(lines)
+
+        root = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(root, 'test.c')
+            with open(filename, 'wb') as output:
+                output.write(content)
+
+            self.assertEqual(content[:1000],
+                             indent_finder.read_bytes(filename, 1000))
+            self.assertEqual(content,
+                             indent_finder.read_bytes(filename, len(content),
+                                                      windows=4))
+
+            data = indent_finder.read_bytes(filename, 1000, windows=4)
+            self.assertLessEqual(len(data), 1000 + 3 * 3)
+
+            windows = data.split(b'\n\n\n\n')
+            self.assertEqual(4, len(windows))
+            self.assertTrue(content.startswith(windows[0]))
+            self.assertTrue(content.endswith(windows[-1]))
+            for window in windows:
+                # Windows hold whole lines.
+                self.assertIn(b'\n' + window.rstrip(b'\n') + b'\n',
+                              b'\n' + content)
+
+            # No step is counted across the gap between windows, even after a
+            # continuation line.
+            for window in [b'{\n', b'{\r', b'{\r\n', b'{\nx \\\n']:
+                finder = indent_finder.IndentFinder()
+                for line in (window + b'\n\n\n    y').splitlines():
+                    finder.analyse_bytes_line(line)
+                self.assertEqual(indent_finder.IndentFinder().lines,
+                                 finder.lines,
+                                 window)
+        finally:
+            shutil.rmtree(root)
+
+    def test_parse_file_with_sampling(self):
+        # A large table indented with tabs comes before code indented with
+        # four spaces.
+        content = (
+            'int table[] = {\n' +
+            ''.join('\t%d,\n' % i for i in range(20000)) +
+            '};\n' +
+            'int f()\n{\n    if (x) {\n        y;\n    }\n}\n' * 10000)
+        self.assertGreater(content.index('int f()'),
+                           indent_finder.MAX_BYTES)
+
+        root = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(root, 'test.c')
+            with open(filename, 'w') as output:
+                output.write(content)
+
+            self.assertEqual(
+                (indent_finder.IndentType.space, 4),
+                indent_finder.parse_file(filename,
+                                         default_tab_width=8,
+                                         default_result=TEST_DEFAULT_RESULT))
+
+            with open(filename, 'rb') as input_file:
+                self.assertEqual(
+                    (indent_finder.IndentType.tab, 8),
+                    indent_finder.parse_file(
+                        filename,
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT,
+                        input_file=input_file))
+        finally:
+            shutil.rmtree(root)
+
+    def test_is_settled(self):
+        counts = [0] * len(indent_finder.COUNT_KEYS)
+        counts[indent_finder.TAB_INDEX] = 100
+        counts[indent_finder.SPACE_OFFSET + 4] = 10
+        self.assertTrue(indent_finder.is_settled(counts, max_increment=89))
+        self.assertFalse(indent_finder.is_settled(counts, max_increment=90))
+
+        counts = [0] * len(indent_finder.COUNT_KEYS)
+        counts[indent_finder.SPACE_OFFSET + 4] = 100
+        counts[indent_finder.SPACE_OFFSET + 2] = 50
+        counts[indent_finder.SPACE_OFFSET + 8] = 50
+        # 2 could still gain the 10% it needs to win over 4.
+        self.assertFalse(indent_finder.is_settled(counts, max_increment=70))
+        self.assertTrue(indent_finder.is_settled(counts, max_increment=40))
+
+        counts = [0] * len(indent_finder.COUNT_KEYS)
+        self.assertFalse(indent_finder.is_settled(counts, max_increment=0))
+
+    def test_confidence(self):
+        def confidence(**counts):
+            lines = dict.fromkeys(indent_finder.COUNT_KEYS, 0)
+            lines.update(counts)
+            return indent_finder.confidence(lines)
+
+        # Default results.
+        self.assertEqual(0, confidence())
+        self.assertEqual(0, confidence(space4=10, tab=10))
+
+        self.assertAlmostEqual(10 / 15., confidence(tab=10))
+        self.assertAlmostEqual(95 / 105., confidence(tab=100, space4=5))
+        self.assertAlmostEqual(1 / 6., confidence(space2=1))
+        self.assertLess(confidence(space2=1), confidence(space2=100))
+
+        # Steps of less than MAX_SPACES spaces are also counted as mixed,
+        # which only the steps counted as mixed alone weigh against.
+        self.assertAlmostEqual(20 / 25., confidence(space2=20, mixed2=20))
+        self.assertAlmostEqual(19 / 25.,
+                               confidence(space2=20, mixed2=20, tab=1))
+        self.assertAlmostEqual(
+            15 / 25., confidence(space4=20, mixed4=20, mixed2=5, tab=1))
+        self.assertAlmostEqual(
+            (100 - 60) / 105., confidence(mixed4=100, space4=40, tab=60))
+
+        # A smaller width must have 10% more steps to win.
+        self.assertAlmostEqual((100 - 105 / 1.1) / 105.,
+                               confidence(space4=100, space2=105))
+        self.assertAlmostEqual((100 - 90 * 1.1) / 105.,
+                               confidence(space4=90, space2=100))
+        self.assertAlmostEqual(0, confidence(space4=100, space2=110))
+
+        for filename in glob.glob(
+                os.path.join(ROOT_PATH, 'test_files', '*', '*')):
+            finder = indent_finder.IndentFinder()
+            indent_finder._parse_file(finder, filename,
+                                      default_tab_width=8,
+                                      default_result=TEST_DEFAULT_RESULT)
+            if finder.evidence is not None:
+                self.assertTrue(
+                    0 <= indent_finder.confidence(finder.lines) < 1,
+                    filename)
+
+    def test_parse_lines(self):
+        default_result = (indent_finder.IndentType.tab, 8)
+
+        for filename in sorted(
+                glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*'))):
+            with open(filename, 'rb') as input_file:
+                self.assertEqual(
+                    indent_finder.parse_file(filename,
+                                             default_tab_width=8,
+                                             default_result=default_result),
+                    indent_finder.parse_lines(input_file,
+                                              default_tab_width=8,
+                                              default_result=default_result,
+                                              filename=filename))
+
+        for (lines, expected) in [
+                (['if x:\n', '  y\n'], (indent_finder.IndentType.space, 2)),
+                ([b'if x:\r\n', b'  y\r\n'],
+                 (indent_finder.IndentType.space, 2)),
+                (['if x:', '  y', '', '      z'],
+                 (indent_finder.IndentType.space, 2)),
+                (['if x:'], default_result),
+                # Like in parse_file(), a form feed breaks a line.
+                ([b'int f()\n', b'{\n', b'    a;\n', b'\x0c\n',
+                  b'        b;\n', b'}\n'],
+                 (indent_finder.IndentType.space, 4))]:
+            self.assertEqual(
+                expected,
+                indent_finder.parse_lines(lines,
+                                          default_tab_width=8,
+                                          default_result=default_result))
+
+        # Only the budget is consumed, even from an endless stream.
+        consumed = []
+
+        def endless_lines():
+            while True:
+                consumed.append(None)
+                yield '    ' * (len(consumed) % 2) + 'x'
+
+        self.assertEqual(
+            (indent_finder.IndentType.space, 4),
+            indent_finder.parse_lines(endless_lines(),
+                                      default_tab_width=8,
+                                      default_result=default_result,
+                                      max_bytes=None,
+                                      max_lines=10))
+        self.assertEqual(10, len(consumed))
+
+        self.assertEqual(
+            (indent_finder.IndentType.space, 4),
+            indent_finder.parse_lines(endless_lines(),
+                                      default_tab_width=8,
+                                      default_result=default_result,
+                                      max_bytes=30))
+        self.assertEqual(10 + 10, len(consumed))
+
+        self.assertEqual(
+            (indent_finder.IndentType.tab, 8),
+            indent_finder.parse_lines(['x', '  x'],
+                                      default_tab_width=8,
+                                      default_result=default_result,
+                                      filename='Makefile'))
+
+    def test_profiling_indent_finder(self):
+        finder = indent_finder.ProfilingIndentFinder()
+        for line in ['int f()', '{', '  x = 1 + \\', '      2;', '',
+                     '  /* comment */', ' \ty;', '    if (x)', '\t{']:
+            finder.analyse_line(line)
+
+        self.assertEqual(
+            {'no_indent lines': 2,
+             'begin_space lines': 2,
+             'space_only lines': 0,
+             'tab_only lines': 1,
+             'mixed lines': 0,
+             'blank lines': 1,
+             'comment lines': 1,
+             'malformed lines': 1,
+             'continuation lines skipped': 1},
+            dict((name, finder.counters[name]) for name in
+                 indent_finder.PROFILE_COUNTERS
+                 if name.endswith('lines') or name.endswith('skipped')))
+        self.assertEqual({'space2': 1, 'mixed2': 1, 'mixed4': 1},
+                         dict((key, value) for (key, value) in
+                              finder.lines.items() if value))
+
+        finder.reset_counters()
+        for filename in glob.glob(os.path.join(ROOT_PATH, 'test_files',
+                                               '*', '*')):
+            self.assertEqual(
+                indent_finder.parse_file(filename,
+                                         default_tab_width=8,
+                                         default_result=TEST_DEFAULT_RESULT),
+                indent_finder._parse_file(finder, filename,
+                                          default_tab_width=8,
+                                          default_result=TEST_DEFAULT_RESULT))
+
+        self.assertGreater(finder.counters['bytes read'], 0)
+        self.assertGreater(finder.counters['analyse seconds'], 0)
+        self.assertEqual(0, finder.counters['bytes decoded'])
+
+    def test_allocations(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            self.skipTest('tracemalloc is not available')
+
+        filenames = sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*')))
+        finder = indent_finder.IndentFinder()
+
+        def parse(filename):
+            return indent_finder._parse_file(
+                finder, filename,
+                default_tab_width=8,
+                default_result=TEST_DEFAULT_RESULT)
+
+        for filename in filenames:
+            parse(filename)
+
+        tracemalloc.start()
+        try:
+            (start, _) = tracemalloc.get_traced_memory()
+            for filename in filenames:
+                (before, _) = tracemalloc.get_traced_memory()
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                parse(filename)
+                (after, peak) = tracemalloc.get_traced_memory()
+
+                # Beyond the lines of the file, each file only allocates a
+                # few temporary objects, and keeps none.
+                self.assertLess(after - before, 256)
+                if hasattr(tracemalloc, 'reset_peak'):
+                    self.assertLess(
+                        peak - before,
+                        4 * min(os.path.getsize(filename),
+                                indent_finder.MAX_BYTES) + 8192,
+                        filename)
+
+            (end, _) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(end - start, 1024)
+        self.assertFalse(hasattr(finder, '__dict__'))
+
+    def test_early_exit(self):
+        root = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(root, 'generated.c')
+            # Larger than MAX_BYTES, so that it is sampled.
+            with open(filename, 'w') as output:
+                output.write('{\n' + 'x\n\tx\n' * 30000)
+
+            finder = indent_finder.IndentFinder()
+            self.assertEqual(
+                ('tab', 8),
+                indent_finder._parse_file(finder, filename,
+                                          default_tab_width=8,
+                                          default_result=TEST_DEFAULT_RESULT,
+                                          early_exit=True))
+            self.assertGreater(finder.lines_saved, 10000)
+
+            # Smaller than MAX_BYTES, with a result that the end overturns.
+            filename = os.path.join(root, 'overturned.txt')
+            with open(filename, 'w') as output:
+                output.write('x\n    x\n' * 300 + 'x\n' * 3000 +
+                             'x\n\tx\n' * 340)
+
+            for early_exit in [False, True]:
+                self.assertEqual(
+                    ('tab', 8),
+                    indent_finder._parse_file(
+                        finder, filename,
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT,
+                        early_exit=early_exit))
+        finally:
+            shutil.rmtree(root)
+
+        for filename in glob.glob(
+                os.path.join(ROOT_PATH, 'test_files', '*', '*')):
+            self.assertEqual(
+                indent_finder.parse_file(filename,
+                                         default_tab_width=8,
+                                         default_result=TEST_DEFAULT_RESULT),
+                indent_finder.parse_file(filename,
+                                         default_tab_width=8,
+                                         default_result=TEST_DEFAULT_RESULT,
+                                         early_exit=True),
+                filename)
+
+    def test_incremental_indent_finder(self):
+        generator = random.Random(0)
+        choices = ['x', 'x {', '\tx', '\t\tx', '  x', '    x', '\t  x',
+                   '        x', 'x \\', '\tx \\', '', '  # x']
+
+        for _ in range(50):
+            lines = [generator.choice(choices)
+                     for _ in range(generator.randint(0, 20))]
+            incremental = indent_finder.IncrementalIndentFinder(
+                lines, filename='test.c')
+
+            for _ in range(20):
+                start = generator.randint(0, len(lines))
+                end = generator.randint(start, len(lines))
+                new_lines = [generator.choice(choices)
+                             for _ in range(generator.randint(0, 3))]
+                lines[start:end] = new_lines
+                incremental.update(start, end, new_lines)
+
+                finder = indent_finder.IndentFinder()
+                expected = indent_finder._parse_lines(
+                    finder, 'test.c', lines,
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT)
+
+                self.assertEqual(finder.lines, incremental.lines, lines)
+                self.assertEqual(
+                    expected,
+                    incremental.results(default_tab_width=8,
+                                        default_result=TEST_DEFAULT_RESULT))
+
+        self.assertRaises(IndexError, incremental.update, 1, 0, [])
+
+    @unittest.skipIf(indent_finder._import_numpy() is None,
+                     'NumPy is not installed')
+    def test_numpy(self):
+        filenames = sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*')))
+
+        finder = indent_finder.IndentFinder()
+        datas = []
+        for filename in filenames:
+            data = indent_finder.read_bytes(filename, indent_finder.MAX_BYTES)
+            if not indent_finder._contains_any(
+                    data, indent_finder.UNICODE_LINE_BOUNDARIES):
+                datas.append(data)
+        datas += [b'', b'\r\n\tx\r  \\\r\n\t\ty\r\n', b'\t  x\n  \tx\n\n']
+
+        (counts, _) = indent_finder._count_steps_with_numpy(
+            indent_finder._import_numpy(), datas, [None] * len(datas))
+        for (data, data_counts) in zip(datas, counts):
+            finder.clear()
+            for line in indent_finder.split_byte_lines(data):
+                finder.analyse_bytes_line(line)
+            self.assertEqual(finder.counts, data_counts)
+
+        for default_result in [(indent_finder.IndentType.space, 4),
+                               (indent_finder.IndentType.tab, 8)]:
+            expected = [
+                (filename,
+                 indent_finder.parse_file(filename,
+                                          default_tab_width=8,
+                                          default_result=default_result),
+                 None)
+                for filename in filenames]
+            self.assertEqual(
+                expected,
+                list(indent_finder.iterate_results(
+                    filenames,
+                    default_tab_width=8,
+                    default_result=default_result,
+                    use_numpy=True)))
+
+        [(_, result_data, error_message)] = indent_finder.iterate_results(
+            ['missing_file'],
+            default_tab_width=8,
+            default_result=(indent_finder.IndentType.space, 4),
+            use_numpy=True)
+        self.assertEqual(None, result_data)
+        self.assertIn('missing_file', error_message)
+
     def test_system(self):
         process = subprocess.Popen(
             [sys.executable, './indent_finder.py', '--default-tab-width=7',
@@ -270,6 +1087,355 @@ class TestIndentFinder(unittest.TestCase):
 
         self.assertEqual(0, process.returncode)
 
+    def test_vim_buffer_output(self):
+        for (filename, arguments) in [
+                (os.path.join(ROOT_PATH, 'test_files', 'tab',
+                              'pretty-make.py'), []),
+                (os.path.join(ROOT_PATH, 'test_files', 'space2',
+                              'TestRunner.cpp'), ['--default-tab-width=4']),
+                (os.path.join(ROOT_PATH, 'test_files', 'space1', 'one.cc'),
+                 ['--default-tab-width=4', '--default-to-tabs',
+                  '--default-spaces=4'])]:
+            process = subprocess.Popen(
+                [sys.executable, './indent_finder.py', '--vim-output'] +
+                arguments + [filename],
+                stdout=subprocess.PIPE)
+
+            # Vim buffers hold lines without their line break.
+            with open(filename) as input_file:
+                lines = input_file.read().splitlines()
+
+            self.assertEqual(
+                process.communicate()[0].decode(),
+                indent_finder.vim_buffer_output(lines, filename, arguments))
+
+        self.assertEqual(
+            'set softtabstop=0 | set tabstop=4 | set noexpandtab | '
+            'set shiftwidth=4 " (tab)',
+            indent_finder.vim_buffer_output(
+                ['x', '  x'], 'Makefile',
+                ['--default-tab-width=4', '--default-to-tabs']))
+
+        self.assertEqual(
+            'set softtabstop=3 | set tabstop=3 | set expandtab | '
+            'set shiftwidth=3 " (space 3)',
+            indent_finder.vim_buffer_output(
+                ('   ' * (i % 2) + 'x' for i in range(100000)), 'x.js'))
+
+    def test_system_with_vim_batch(self):
+        import json
+
+        filenames = [
+            os.path.join(ROOT_PATH, 'test_files', 'tab', 'pretty-make.py'),
+            'missing : file.c',
+            os.path.join(ROOT_PATH, 'test_files', 'space1', 'one.cc')]
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--vim-batch'] +
+            filenames,
+            stdout=subprocess.PIPE)
+
+        self.assertEqual(
+            [[filenames[0],
+              'set softtabstop=0 | set tabstop=8 | set noexpandtab | '
+              'set shiftwidth=8 " (tab)'],
+             [filenames[1], ''],
+             [filenames[2],
+              'set softtabstop=1 | set tabstop=1 | set expandtab | '
+              'set shiftwidth=1 " (space 1)']],
+            [json.loads(line) for line in
+             process.communicate()[0].decode().splitlines()])
+
+        self.assertEqual(0, process.returncode)
+
+    def test_system_with_stdin(self):
+        filename = os.path.join(ROOT_PATH, 'test_files', 'space2',
+                                'TestRunner.cpp')
+        with open(filename, 'rb') as input_file:
+            content = input_file.read()
+
+        for (stdin_filename, expected) in [('missing_file.cpp', 'space 2\n'),
+                                           ('missing_file.py', 'space 4\n'),
+                                           ('Makefile', 'tab 8\n')]:
+            process = subprocess.Popen(
+                [sys.executable, './indent_finder.py',
+                 '--stdin-filename=' + stdin_filename],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+
+            self.assertEqual(expected,
+                             process.communicate(content)[0].decode())
+            self.assertEqual(0, process.returncode)
+
+    def test_parse_simple_arguments(self):
+        for arguments in [[],
+                          ['foo.c', 'bar'],
+                          ['--vim-output', '--default-tab-width=4', 'foo.c'],
+                          ['--default-to-tabs', '--default-spaces=2'],
+                          ['--stdin-filename=foo.c'],
+                          ['--vim-batch', '--default-to-tabs', 'a', 'b']]:
+            (options, args) = indent_finder._parse_simple_arguments(
+                arguments)
+            (expected_options, expected_args) = (
+                indent_finder._parse_arguments(arguments))
+            self.assertEqual(vars(expected_options),
+                             dict((name, getattr(options, name))
+                                  for name in vars(expected_options)))
+            self.assertEqual(expected_args, args)
+
+        for arguments in [['--jobs=2', 'foo.c'],
+                          ['--default-spaces', '2'],
+                          ['--default-spaces=two'],
+                          ['--stdin-filename=foo.c', 'bar.c'],
+                          ['--stdin-filename=foo.c', '--vim-batch'],
+                          ['-']]:
+            self.assertEqual(
+                None, indent_finder._parse_simple_arguments(arguments))
+
+    def test_system_with_minimal_startup(self):
+        if sys.version_info < (3, 7):
+            # Without module __getattr__(), the patterns are compiled on
+            # import.
+            deferred_modules = ['optparse']
+        else:
+            deferred_modules = ['optparse', 're']
+
+        process = subprocess.Popen(
+            [sys.executable, '-S', '-E', '-c',
+             'import sys, indent_finder; '
+             'sys.argv[1:] = ["--default-tab-width=7", sys.argv[2]]; '
+             'indent_finder.main(); '
+             'print(sorted(set(sys.argv[1].split(",")) & set(sys.modules)))',
+             ','.join(deferred_modules),
+             os.path.join(ROOT_PATH, 'test_files', 'tab', 'pretty-make.py')],
+            stdout=subprocess.PIPE)
+
+        self.assertEqual('tab 7\n[]\n', process.communicate()[0].decode())
+        self.assertEqual(0, process.returncode)
+
+    def test_system_with_jobs(self):
+        filenames = sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*')))
+
+        serial = subprocess.Popen(
+            [sys.executable, './indent_finder.py'] + filenames,
+            stdout=subprocess.PIPE).communicate()[0].decode()
+
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--jobs=3'] + filenames,
+            stdout=subprocess.PIPE)
+        self.assertEqual(serial, process.communicate()[0].decode())
+        self.assertEqual(0, process.returncode)
+
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--jobs=3', '--unordered'] +
+            filenames,
+            stdout=subprocess.PIPE)
+        self.assertEqual(
+            sorted(serial.splitlines()),
+            sorted(process.communicate()[0].decode().splitlines()))
+        self.assertEqual(0, process.returncode)
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'requires Python 3.6')
+    def test_concurrent_reads(self):
+        import threading
+        import time
+
+        import indent_finder_async
+
+        filenames = sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*')))
+        filenames[10:10] = ['Makefile', 'missing_file.c']
+
+        expected = []
+        for (filename, result_data, error_message, evidence) in (
+                indent_finder.iterate_results(
+                    filenames,
+                    default_tab_width=8,
+                    default_result=TEST_DEFAULT_RESULT,
+                    with_evidence=True)):
+            if error_message is not None:
+                error_message = 'missing'
+            expected.append((filename, result_data, error_message, evidence))
+
+        # Stand-in for a file system with a high latency that counts how many
+        # reads are in flight.
+        lock = threading.Lock()
+        reads = {'current': 0, 'most': 0}
+
+        def slow_read(filename):
+            with lock:
+                reads['current'] += 1
+                reads['most'] = max(reads['most'], reads['current'])
+            try:
+                time.sleep(0.01)
+                return indent_finder_async.read_file(filename)
+            finally:
+                with lock:
+                    reads['current'] -= 1
+
+        for (concurrency, ordered) in [(1, True), (8, True), (8, False)]:
+            reads['most'] = 0
+            results = []
+            for (filename, result_data, error_message, evidence) in (
+                    indent_finder_async.iterate_results(
+                        filenames,
+                        default_tab_width=8,
+                        default_result=TEST_DEFAULT_RESULT,
+                        concurrency=concurrency,
+                        ordered=ordered,
+                        with_evidence=True,
+                        read=slow_read)):
+                if error_message is not None:
+                    self.assertIn('missing_file.c', error_message)
+                    error_message = 'missing'
+                results.append((filename, result_data, error_message,
+                                evidence))
+
+            if ordered:
+                self.assertEqual(expected, results)
+            else:
+                self.assertEqual(sorted(expected), sorted(results))
+            self.assertEqual(concurrency, reads['most'])
+
+        # Reads still in flight are abandoned when results are not consumed.
+        results = indent_finder_async.iterate_results(
+            filenames,
+            default_tab_width=8,
+            default_result=TEST_DEFAULT_RESULT,
+            read=slow_read)
+        self.assertEqual(expected[0][:3], next(results))
+        results.close()
+
+        filenames = filenames[:10]
+        serial = subprocess.Popen(
+            [sys.executable, './indent_finder.py'] + filenames,
+            stdout=subprocess.PIPE).communicate()[0].decode()
+
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--concurrent-reads=4'] +
+            filenames,
+            stdout=subprocess.PIPE)
+        self.assertEqual(serial, process.communicate()[0].decode())
+        self.assertEqual(0, process.returncode)
+
+    def test_system_with_json(self):
+        import json
+
+        filenames = sorted(
+            glob.glob(os.path.join(ROOT_PATH, 'test_files', '*', '*')))
+
+        serial = subprocess.Popen(
+            [sys.executable, './indent_finder.py'] + filenames,
+            stdout=subprocess.PIPE).communicate()[0].decode()
+
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--json', '--jobs=2'] +
+            filenames + ['missing.c'],
+            stdout=subprocess.PIPE)
+        records = [json.loads(line) for line in
+                   process.communicate()[0].decode().splitlines()]
+        self.assertEqual(1, process.returncode)
+
+        self.assertEqual(
+            serial,
+            ''.join('%s : %s\n' % (record['filename'], record['result'])
+                    for record in records[:-1]))
+
+        for record in records[:-1]:
+            if record['counts'] is not None:
+                self.assertEqual(
+                    record['result'],
+                    indent_finder.results_to_string(indent_finder.results(
+                        record['counts'],
+                        default_tab_width=8,
+                        default_result=(indent_finder.IndentType.space, 4))))
+                self.assertEqual(
+                    indent_finder.confidence(record['counts']),
+                    record['confidence'])
+            else:
+                self.assertIsNone(record['confidence'])
+            self.assertGreaterEqual(record['seconds'], 0)
+            self.assertIsNone(record['error'])
+
+        record = [record for record in records
+                  if record['filename'].endswith('TestRunner.cpp')][0]
+        self.assertLessEqual(record['bytes'],
+                             os.path.getsize(record['filename']))
+        self.assertGreater(record['bytes'], 0)
+        self.assertGreater(record['lines'], 0)
+
+        self.assertEqual('missing.c', records[-1]['filename'])
+        self.assertIsNone(records[-1]['result'])
+        self.assertIsNone(records[-1]['counts'])
+        self.assertTrue(records[-1]['error'])
+
+    def test_system_with_exclude_outside_current_directory(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ['cwd', 'tree', os.path.join('tree', 'sub')]:
+                os.mkdir(os.path.join(root, path))
+            for path in ['a.py', os.path.join('sub', 'b.py')]:
+                with open(os.path.join(root, 'tree', path), 'w') as output:
+                    output.write('if x:\n  y\n')
+
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT_PATH, 'indent_finder.py'),
+                 '--exclude=/sub/',
+                 os.path.join(os.pardir, 'tree')],
+                cwd=os.path.join(root, 'cwd'),
+                stdout=subprocess.PIPE)
+
+            self.assertEqual(
+                '%s : space 2\n' % (os.path.join(os.pardir, 'tree', 'a.py'),),
+                process.communicate()[0].decode())
+            self.assertEqual(0, process.returncode)
+        finally:
+            shutil.rmtree(root)
+
+    def test_system_with_jobs_and_missing_file(self):
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--jobs=2',
+             os.path.join(ROOT_PATH, 'test_files', 'tab', 'pretty-make.py'),
+             'missing_file'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+        (output, error) = process.communicate()
+        self.assertIn('missing_file', error.decode())
+        self.assertEqual(1, process.returncode)
+
+    def test_system_with_server(self):
+        process = subprocess.Popen(
+            [sys.executable, './indent_finder.py', '--server',
+             '--default-tab-width=7'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+
+        requests = [
+            '[1, {"filename": "%s"}]' % os.path.join(
+                ROOT_PATH, 'test_files', 'tab', 'pretty-make.py'),
+            'garbage',
+            '[2, {"filename": "missing_file"}]',
+            '[3, {"filename": "%s"}]' % os.path.join(
+                ROOT_PATH, 'test_files', 'space2', 'TestRunner.cpp'),
+            '[4, {"filename": "missing_file.c", '
+            '"lines": ["int main() {", "   return 0;", "}"]}]',
+            '[5, {"filename": 5}]',
+            '[6, {"filename": "missing_file.c", "lines": [1, 2]}]',
+            '[7, {"filename": "missing_file.c", "lines": "x"}]',
+            '[8, "missing_file"]',
+        ]
+        output = process.communicate(
+            ('\n'.join(requests) + '\n').encode())[0].decode()
+
+        self.assertEqual(
+            '[1, "tab 7"]\n'
+            '[2, ""]\n'
+            '[3, "space 2"]\n'
+            '[4, "space 3"]\n',
+            output)
+        self.assertEqual(0, process.returncode)
+
 
 if __name__ == '__main__':
     unittest.main(testRunner=unittest.TextTestRunner())
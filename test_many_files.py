@@ -7,8 +7,15 @@
 # a copy of the file LICENSE.txt along with this software.
 
 import glob
+import os
+import sys
 import unittest
 
+# Import indent_finder from plugin/, where setup.py build_ext --inplace puts
+# its optional accelerator.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'plugin'))
+
 import indent_finder
 
 